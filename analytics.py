@@ -0,0 +1,224 @@
+import numpy as np
+import pandas as pd
+
+from ingest import AGE_LABELS
+
+# ================= 预聚合立方体 =================
+# 粒度 (部门, 月份, 服务商, 仓库, 库龄段)，KPI / 库龄结构 / 趋势图都由它上卷得到
+CUBE_DIMS = ['Dept', 'Date', 'Provider', 'Warehouse', 'Age_Range']
+CUBE_MEASURES = ['Qty', 'Fee', 'Vol', 'Rows']
+
+def widen(df):
+    # Qty 按行存 float32 (单行精确)，但 float32 求和超过 2^24 会丢单位：聚合前先转 float64
+    if 'Qty' in df.columns and df['Qty'].dtype != 'float64': df = df.assign(Qty=df['Qty'].astype('float64'))
+    return df
+
+def build_cube(df):
+    cube = widen(df).groupby(CUBE_DIMS, observed=True).agg(
+        Qty=('Qty', 'sum'), Fee=('Fee', 'sum'), Vol=('Vol', 'sum'), Rows=('Qty', 'size'),
+    ).reset_index()
+    for col in ['Qty', 'Fee', 'Vol']: cube[col] = cube[col].astype('float64')
+    return cube
+
+def select(frame, **sel):
+    # sel: 维度=取值 或 取值列表；None 表示不筛选 (全部汇总)
+    mask = np.ones(len(frame), dtype=bool)
+    for dim, value in sel.items():
+        if value is None: continue
+        values = list(value) if pd.api.types.is_list_like(value) else [value]
+        mask &= frame[dim].isin(values).to_numpy()
+    return frame[mask]
+
+def rollup(cube, by=None, **sel):
+    part = select(cube, **sel)
+    if not by: return part[CUBE_MEASURES].sum()
+    return part.groupby(by, observed=True)[CUBE_MEASURES].sum().reset_index()
+
+def age_summary(cube, **sel):
+    # 库龄结构表：各库龄段的费用/数量/体积及占比
+    summary = rollup(cube, by='Age_Range', **sel)[['Age_Range', 'Fee', 'Qty', 'Vol']]
+    summary['费用占比'] = (summary['Fee'] / summary['Fee'].sum() * 100).fillna(0)
+    summary['体积占比'] = (summary['Vol'] / summary['Vol'].sum() * 100).fillna(0)
+    return summary
+
+def cpu_by_date(cube, **sel):
+    trend = rollup(cube, by='Date', **sel)
+    trend['CPU'] = np.where(trend['Qty'] > 0, trend['Fee'] / trend['Qty'].where(trend['Qty'] > 0, 1), 0)
+    return trend[['Date', 'CPU']]
+
+# ================= 趋势指标引擎 =================
+# 一次分组 (月份[, 拆分维度], 库龄段) 得到全部管理层 KPI：CPU、潜在节省 (360天+ 费用)、
+# 各库龄段费用占比、环比、滚动均值；趋势页所有图表都取自这一次计算
+SAVINGS_BUCKET = AGE_LABELS[-1]
+TREND_DELTA_COLS = ['CPU', 'Fee', 'Qty', '潜在节省']
+TREND_ROLLING_COLS = ['CPU', 'Fee', '潜在节省']
+
+def _trend_kpis(grid, keys, window):
+    # grid: 以 keys + ['Age_Range'] 为索引的 Qty/Fee/Vol 汇总
+    sums = grid.groupby(level=keys, observed=True).sum()
+    fee = grid['Fee'].unstack('Age_Range', fill_value=0)
+    fee.columns = fee.columns.astype(str)
+    fee = fee.reindex(index=sums.index, columns=AGE_LABELS, fill_value=0)
+    out = sums.reset_index()
+    qty, total_fee = out['Qty'].to_numpy(), out['Fee'].to_numpy()
+    out['CPU'] = np.where(qty > 0, total_fee / np.where(qty > 0, qty, 1), 0)
+    out['潜在节省'] = fee[SAVINGS_BUCKET].to_numpy()
+    share = fee.to_numpy() / np.where(total_fee > 0, total_fee, 1)[:, None] * 100
+    for i, label in enumerate(AGE_LABELS): out[f'费用占比@{label}'] = share[:, i]
+
+    # 环比 / 滚动均值：按拆分维度分段、段内按月份排序，用 shift 和累计和向量化计算
+    dims = keys[1:]
+    out = out.sort_values(dims + ['Date']).reset_index(drop=True)
+    group = out.groupby(dims, observed=True, sort=False) if dims else out.groupby(np.zeros(len(out), dtype=int))
+    pos = group.cumcount().to_numpy()
+    for col in TREND_DELTA_COLS:
+        prev = group[col].shift(1)
+        out[f'{col}环比'] = out[col] - prev
+        out[f'{col}环比%'] = (out[col] / prev.where(prev > 0) - 1) * 100
+    for col in TREND_ROLLING_COLS:
+        csum = group[col].cumsum()
+        lagged = csum.groupby(group.ngroup(), sort=False).shift(window).fillna(0)
+        out[f'{col}滚动{window}月'] = (csum - lagged) / np.minimum(pos + 1, window)
+    return out
+
+def trend_metrics(cube, by=None, window=3, **sel):
+    # 返回 {'total': 按月份的 KPI, 'breakdown': 按 月份×by 的 KPI (by 为 None 时为 None), 'ages': 月份×库龄段 明细}
+    part = select(cube, **sel)
+    keys = ['Date'] + ([by] if by else [])
+    grid = part.groupby(keys + ['Age_Range'], observed=True)[['Qty', 'Fee', 'Vol']].sum()
+    by_age = grid.groupby(level=['Date', 'Age_Range'], observed=True).sum() if by else grid
+    ages = by_age.reset_index()
+    month_fee = ages.groupby('Date', observed=True)['Fee'].transform('sum')
+    ages['费用占比'] = (ages['Fee'] / month_fee.where(month_fee > 0) * 100).fillna(0)
+    return {
+        'total': _trend_kpis(by_age, ['Date'], window),
+        'breakdown': _trend_kpis(grid, keys, window) if by else None,
+        'ages': ages,
+    }
+
+# ================= 多月恶化 (库龄漂移) 引擎 =================
+# 一次分组构建 键×月份 的库龄段编码矩阵，向量化比较所有相邻月份
+DRIFT_KEYS = ['SKU', 'Warehouse', 'Dept', 'Provider']
+DRIFT_COLS = DRIFT_KEYS + ['月份', 'Age_Range_old', 'Age_Range_new', '跳档', '连续恶化', '恶化次数', 'Fee']
+
+def drift_matrix(df, dates):
+    # 返回 (键编码, 库龄矩阵, 费用矩阵)；同一键同月有多个库龄段时取最差的一段，缺席的月份为 -1
+    n_months = len(dates)
+    month_of_cat = pd.Index(dates).get_indexer(df['Date'].cat.categories.astype(str))
+    date_codes = df['Date'].cat.codes.to_numpy()
+    month = np.where(date_codes >= 0, month_of_cat[date_codes], -1)
+    valid = month >= 0
+    combined = np.zeros(len(df), dtype=np.int64)
+    for col in DRIFT_KEYS:
+        codes = df[col].cat.codes.to_numpy().astype(np.int64)
+        valid &= codes >= 0
+        combined = combined * len(df[col].cat.categories) + codes
+    kid, uniq = pd.factorize(combined[valid])
+    cell = pd.DataFrame({
+        'flat': kid.astype(np.int64) * n_months + month[valid],
+        'age': df['Age_Range'].cat.codes.to_numpy()[valid],
+        'fee': df['Fee'].to_numpy()[valid],
+    }).groupby('flat').agg(age=('age', 'max'), fee=('fee', 'sum'))
+    age_mat = np.full(len(uniq) * n_months, -1, dtype=np.int8)
+    fee_mat = np.zeros(len(uniq) * n_months)
+    age_mat[cell.index.to_numpy()] = cell['age'].to_numpy()
+    fee_mat[cell.index.to_numpy()] = cell['fee'].to_numpy()
+    return uniq, age_mat.reshape(-1, n_months), fee_mat.reshape(-1, n_months)
+
+def detect_drift(df, dates):
+    dates = sorted(str(d) for d in dates)
+    if len(dates) < 2 or df.empty: return pd.DataFrame(columns=DRIFT_COLS)
+    uniq, age_mat, fee_mat = drift_matrix(df, dates)
+    prev, curr = age_mat[:, :-1], age_mat[:, 1:]
+    worse = (prev >= 0) & (curr > prev)
+    rows = np.flatnonzero(worse.any(axis=1))
+    if not len(rows): return pd.DataFrame(columns=DRIFT_COLS)
+    worse = worse[rows]
+
+    # 最近一次恶化所在的月份对 (j -> j+1)
+    last = worse.shape[1] - 1 - np.argmax(worse[:, ::-1], axis=1)
+    old, new = prev[rows, last], curr[rows, last]
+    # 最长连续恶化段：月份数有限，按列推进、对所有键向量化
+    run = best = np.zeros(len(rows), dtype=np.int32)
+    for j in range(worse.shape[1]):
+        run = np.where(worse[:, j], run + 1, 0)
+        best = np.maximum(best, run)
+
+    out = {}
+    rest = uniq[rows]
+    for col in reversed(DRIFT_KEYS):
+        cats = df[col].cat.categories
+        rest, codes = np.divmod(rest, len(cats))
+        out[col] = pd.Categorical.from_codes(codes, categories=cats)
+    pairs = np.array([f"{a}→{b}" for a, b in zip(dates[:-1], dates[1:])])
+    result = pd.DataFrame({col: out[col] for col in DRIFT_KEYS})
+    result['月份'] = pairs[last]
+    result['Age_Range_old'] = pd.Categorical.from_codes(old, dtype=df['Age_Range'].dtype)
+    result['Age_Range_new'] = pd.Categorical.from_codes(new, dtype=df['Age_Range'].dtype)
+    result['跳档'] = (new - old).astype(int)
+    result['连续恶化'] = best
+    result['恶化次数'] = worse.sum(axis=1)
+    result['Fee'] = fee_mat[rows, last + 1]
+    return result
+
+# ================= 跨月追踪宽表 =================
+TRACK_AGG = {'Qty': 'sum', 'Vol': 'sum', 'Fee': 'sum', 'Age': 'mean'}
+
+def tracking_pivot(df, keys):
+    # 单次分组得到 键 × 月份 的宽表，列名为 "度量@月份"；切换展示月份只需挑列
+    if df.empty: return pd.DataFrame(columns=keys)
+    flat = widen(df).groupby(keys + ['Date'], observed=True).agg(TRACK_AGG).reset_index()
+    flat['Date'] = flat['Date'].astype(str)
+    wide = flat.set_index(keys + ['Date']).unstack('Date')
+    wide.columns = [f"{measure}@{date}" for measure, date in wide.columns]
+    return wide.reset_index()
+
+# ================= SKU 宏观聚合 =================
+def sku_macro(drill, count_depts=False, count_provs=False):
+    # 忽略仓库/部门差异按 SKU 合并；count_* 为 True 时在分布情况里列出跨部门/跨服务商数
+    base_df = widen(drill).groupby('SKU', observed=True).agg({
+        'Qty': 'sum', 'Vol': 'sum', 'Fee': 'sum', 'Age': 'mean',
+        'Warehouse': 'nunique', 'Dept': 'nunique', 'Provider': 'nunique'
+    }).reset_index()
+    return with_distribution(base_df, count_depts, count_provs)
+
+def distribution_labels(n_wh, n_dept=None, n_prov=None, count_depts=False, count_provs=False):
+    # 向量化生成 "2个部门 | 3个服务商 | 5个仓"：部门/服务商只在跨多个时出现
+    label = pd.Series(np.asarray(n_wh, dtype=np.int64)).astype(str) + '个仓'
+    for flag, counts, unit in [(count_provs, n_prov, '个服务商'), (count_depts, n_dept, '个部门')]:
+        if not flag: continue
+        counts = pd.Series(np.asarray(counts, dtype=np.int64))
+        label = (counts.astype(str) + f'{unit} | ').where(counts > 1, '') + label
+    return label.to_numpy(dtype=object)
+
+def with_distribution(base_df, count_depts=False, count_provs=False):
+    # base_df 的 Warehouse/Dept/Provider 列为去重计数
+    base_df['分布情况'] = distribution_labels(base_df['Warehouse'], base_df['Dept'], base_df['Provider'], count_depts, count_provs)
+    return base_df
+
+def selection_key(sel):
+    # 把筛选条件转成可哈希的缓存键
+    return tuple((dim, tuple(v) if pd.api.types.is_list_like(v) else v) for dim, v in sorted(sel.items()))
+
+# ================= 深钻分页 =================
+def ranked_positions(values, stop, start=0, ascending=False):
+    # 排名 [start, stop) 的行号：argpartition 部分选择 + 只对前 stop 行排序，不做全量排序
+    # 同值按行号先后排列，翻页时边界上的并列行不会重复或遗漏
+    key = np.asarray(values, dtype='float64')
+    if not ascending: key = -key
+    key = np.where(np.isnan(key), np.inf, key)
+    stop = min(stop, len(key))
+    if start >= stop: return np.empty(0, dtype=np.intp)
+    if stop < len(key):
+        kth = np.partition(key, stop - 1)[stop - 1]
+        less = np.flatnonzero(key < kth)
+        cand = np.concatenate([less, np.flatnonzero(key == kth)[:stop - len(less)]])
+    else:
+        cand = np.arange(len(key))
+    order = cand[np.lexsort((cand, key[cand]))]
+    return order[start:stop]
+
+def key_index(frame, keys):
+    # 按字符串键建索引，分类编码不同的两张表也能直接对齐
+    if len(keys) == 1: return pd.Index(frame[keys[0]].astype(str).to_numpy())
+    return pd.MultiIndex.from_arrays([frame[k].astype(str).to_numpy() for k in keys])
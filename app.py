@@ -1,165 +1,56 @@
 import streamlit as st
 import pandas as pd
-import io
 import altair as alt
-import gc
 import os
-
-# ================= 1. 配置与映射 =================
-COLUMN_MAPS = {
-    'WP': { 
-        'SKU': 'SKU', 'Warehouse': '仓库/Warehouse', 
-        'Qty': '数量/Quantity', 'Fee': '金额/Amount', 
-        'Age': '库龄/Library of Age', 'Vol': '体积(m³)',
-        'Full_Name': 'WesternPost'
-    },
-    'LG': { 
-        'SKU': '乐仓货品编码', 'Warehouse': '仓库', 
-        'Qty': '数量', 'Fee': '计算金额', 
-        'Age': '库龄', 'Vol': '总体积',
-        'Full_Name': 'Lecangs'
-    },
-    'AI': { 
-        'SKU': 'SKU', 'Warehouse': '仓库', 
-        'Qty': '库存', 'Fee': '费用', 
-        'Age': '在库天数', 'Vol': '立方数',
-        'Full_Name': 'AI'
-    },
-    'WL': { 
-        'SKU': '商品SKU', 'Warehouse': '实际发货仓库', 
-        'Qty': '库存总数_QTY', 'Fee': '计费总价', 
-        'Age': '库存库龄_CD', 'Vol': '计费总体积_立方米',
-        'Full_Name': 'WWL'
-    }
-}
-
-AGE_BINS = [-1, 30, 60, 90, 120, 180, 360, 99999]
-AGE_LABELS = ['0-30天', '31-60天', '61-90天', '91-120天', '121-180天', '181-360天', '360天+']
-AGE_MAP = {label: i for i, label in enumerate(AGE_LABELS)}
-
-# ================= 2. 核心处理逻辑 =================
-
-def parse_filename(filename):
-    try:
-        name_body = filename.rsplit('.', 1)[0]
-        parts = name_body.split('_')
-        if len(parts) >= 3:
-            dept = parts[0]
-            raw_code = parts[1].upper()
-            provider_code = None
-            for key in COLUMN_MAPS.keys():
-                if key in raw_code:
-                    provider_code = key
-                    break
-            date_str = parts[2]
-            return dept, provider_code, date_str
-        return None, None, None
-    except Exception:
-        return None, None, None
-
-@st.cache_data(ttl=3600, show_spinner=False)
-def load_data_cached(file_content, file_name):
-    try:
-        file = io.BytesIO(file_content)
-        file.name = file_name 
-        dept, provider_code, date_str = parse_filename(file.name)
-        
-        if not dept:
-            dept = "默认部门"
-            for code in COLUMN_MAPS.keys():
-                if code in file.name.upper():
-                    provider_code = code
-                    break
-            date_str = "最新"
-
-        if not provider_code: return pd.DataFrame()
-
-        df = None
-        try: df = pd.read_excel(file, engine='openpyxl', header=None); 
-        except: pass
-        if df is None:
-            try: file.seek(0); df = pd.read_csv(file, encoding='utf-8', header=None)
-            except: pass
-        if df is None:
-            try: file.seek(0); df = pd.read_csv(file, encoding='gb18030', header=None)
-            except: pass
-        if df is None: return pd.DataFrame()
-
-        mapping = COLUMN_MAPS[provider_code]
-        header_idx = 0
-        expected_cols = set(mapping.values())
-        expected_cols.discard(mapping.get('Full_Name'))
-        
-        for i in range(min(20, len(df))):
-            row_values = df.iloc[i].astype(str).str.strip().tolist()
-            row_values = [x.replace('\ufeff', '') for x in row_values]
-            match_count = sum(1 for x in row_values if x in expected_cols)
-            if match_count >= 2:
-                header_idx = i
-                break
-        
-        new_columns = df.iloc[header_idx].astype(str).str.strip().str.replace('\ufeff', '')
-        df = df.iloc[header_idx+1:].copy()
-        df.columns = new_columns
-
-        if provider_code == 'WL':
-            if not df.empty: df = df.iloc[1:]
-
-        valid_map = {k: v for k, v in mapping.items() if v in df.columns}
-        rename_dict = {v: k for k, v in valid_map.items()}
-        df = df.rename(columns=rename_dict)
-        
-        required_cols = ['SKU', 'Warehouse', 'Qty', 'Fee', 'Age', 'Vol']
-        for col in required_cols:
-            if col not in df.columns: df[col] = 0 
-        
-        if provider_code == 'LG':
-            if 'SKU' in df.columns:
-                df['SKU'] = df['SKU'].astype(str).apply(lambda x: x.split('-', 1)[1] if '-' in x else x)
-
-        for col in ['Qty', 'Fee', 'Age', 'Vol']:
-            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
-            
-        cut_series = pd.cut(df['Age'], bins=AGE_BINS, labels=AGE_LABELS, right=True)
-        df['Age_Range'] = cut_series.astype(str)
-        df.loc[df['Age_Range'] == 'nan', 'Age_Range'] = '360天+'
-        df['Age_Range'] = df['Age_Range'].str.strip()
-
-        df['Dept'] = str(dept)
-        df['Provider'] = str(mapping['Full_Name'])
-        df['Date'] = str(date_str)
-        
-        gc.collect()
-        return df
-    except Exception: return pd.DataFrame()
+import time
+from cache import MemoryCache, fingerprint
+from sku_dict import SkuDictionary
+from dataset import DatasetManager, FilterEngine, SkuMacroIndex
+from export import EXPORT_MIME, export_file
+from profiler import Profiler, file_frame
+from analytics import (
+    TRACK_AGG, age_summary, detect_drift, key_index, ranked_positions, rollup, select, selection_key,
+    tracking_pivot, trend_metrics,
+)
+from ingest import AGE_LABELS, DEFAULT_WORKERS, format_mismatch, iter_load_files
+from engine import (
+    DEFAULT_DICT_PATH, HAS_DUCKDB, HISTORY_DIR, SNAPSHOT_DIR, load_data, load_sku_mapping, open_history, open_store,
+    read_artifacts, read_manifest,
+)
+
+# ================= 1-2. 配置与核心处理 (见 engine.py / ingest.py) =================
+snapshot_store = open_store(SNAPSHOT_DIR)
+CACHE_BUDGET_MB = int(os.environ.get('LTL_CACHE_MB', '1024'))
+
+# 进程级共享缓存：按字节预算 LRU 淘汰，解析结果与派生聚合共用一个预算 (见 cache.py)
+@st.cache_resource(show_spinner=False)
+def shared_cache(budget_mb):
+    return MemoryCache(budget_mb * 1024 * 1024)
+
+cache = shared_cache(CACHE_BUDGET_MB)
+
+def load_data_cached(file_content, file_name, key):
+    # 以全量内容指纹 (与快照库同一个键) 为键：不同会话上传同一文件共用解析结果
+    return cache.get_or_build(('load', key), lambda: load_data(file_content, file_name, snapshot_store, key), group='load')
+
+def file_key(file):
+    # 全量 SHA1 每次上传只算一次，按上传对象的 file_id 记住：同名同大小的重新导出是新的 file_id，
+    # 不会取回旧指纹。抽样指纹只是附加校验，不能代替全量指纹
+    content = file.getvalue()
+    return cache.get_or_build(('key', file.file_id, fingerprint(content, file.name)),
+                              lambda: snapshot_store.key(content, file.name), group='key')
 
 # ----------------------------------------------------
-# 全能字典读取器 (保持 V5.6 的稳健性)
+# SKU 字典 (见 sku_dict.py)：索引按文件内容指纹持久化在快照目录
 # ----------------------------------------------------
-@st.cache_data(ttl=3600, show_spinner=False)
-def load_sku_mapping(file_source):
-    if isinstance(file_source, str):
-        with open(file_source, 'rb') as f: content = f.read()
-    else: content = file_source.getvalue()
-        
-    df = None
-    try: df = pd.read_excel(io.BytesIO(content))
-    except:
-        encodings = ['utf-8', 'gbk', 'gb18030', 'utf-8-sig']
-        for enc in encodings:
-            try:
-                df = pd.read_csv(io.BytesIO(content), header=0, encoding=enc)
-                if len(df.columns) >= 2: break
-            except: continue
-            
-    if df is None or len(df.columns) < 2: return {}
+@st.cache_resource(show_spinner=False)
+def load_sku_dictionary(path, mtime):
+    return load_sku_mapping(path, SNAPSHOT_DIR)
 
-    try:
-        sku_col = df.columns[0]
-        name_col = df.columns[1]
-        mapping = dict(zip(df[sku_col].astype(str).str.strip(), df[name_col].astype(str).str.strip()))
-        return mapping
-    except: return {}
+# 磁盘历史库是进程级共享的 (只追加)，所有会话共用一个查询连接
+@st.cache_resource(show_spinner=False)
+def load_history(root):
+    return open_history(root)
 
 # ================= 3. 界面逻辑 =================
 st.set_page_config(page_title="海外仓库存 BI V5.7", page_icon="🏢", layout="wide")
@@ -168,13 +59,12 @@ st.title("🏢 海外仓库存分析看板 V5.7")
 # ----------------------------------------------------
 # 自动加载字典 (无感模式)
 # ----------------------------------------------------
-DEFAULT_DICT_PATH = "sku_dict.csv" 
-sku_map = {}
+sku_dict = SkuDictionary.empty()
 dict_status = ""
 
 if os.path.exists(DEFAULT_DICT_PATH):
-    sku_map = load_sku_mapping(DEFAULT_DICT_PATH)
-    dict_status = f"✅ 字典已就绪 ({len(sku_map)})"
+    sku_dict = load_sku_dictionary(DEFAULT_DICT_PATH, os.path.getmtime(DEFAULT_DICT_PATH))
+    dict_status = f"✅ 字典已就绪 ({len(sku_dict)} · {sku_dict.source_format})"
 else:
     dict_status = "⚠️ 无默认字典"
 
@@ -188,91 +78,200 @@ with st.sidebar:
     st.divider()
     
     if st.button("🧹 刷新缓存"):
+        cache.clear()
         st.cache_data.clear()
+        st.cache_resource.clear()
+        st.session_state.pop('dataset', None)
         st.success("缓存已清除")
 
-    dfs = []
-    if uploaded_files:
+    with st.expander("🧠 缓存"):
+        cs = cache.stats()
+        st.caption(f"{cs['entries']} 条 · {cs['bytes'] / 2 ** 20:.1f} / {cs['budget'] / 2 ** 20:.0f} MB · "
+                   f"命中率 {cs['hit_rate']:.0%} ({cs['hits']}/{cs['hits'] + cs['misses']}) · 淘汰 {cs['evictions']}")
+        cache_entries = cache.entries()
+        if not cache_entries.empty:
+            cache_entries['label'] = [f"{g} · {str(k)[:60]} · {mb:.1f}MB" for k, g, mb in
+                                      zip(cache_entries['key'], cache_entries['group'], cache_entries['MB'])]
+            st.dataframe(cache_entries[['group', 'MB', 'hits', 'age_s']].round(2), use_container_width=True, hide_index=True)
+            drop = st.multiselect("失效条目", cache_entries.index, format_func=cache_entries['label'].get, key='cache_drop')
+            c_a, c_b = st.columns(2)
+            if c_a.button("失效所选", key='cache_drop_btn'):
+                for i in drop: cache.invalidate(key=cache_entries.at[i, 'key'])
+                st.success(f"已失效 {len(drop)} 条")
+            if c_b.button("失效派生结果", key='cache_drop_derived'):
+                st.success(f"已失效 {cache.invalidate(group='derived')} 条")
+
+    if snapshot_store.enabled:
+        with st.expander("🗄️ 快照库"):
+            snap_list = snapshot_store.list()
+            st.caption(f"{len(snap_list)} 个快照 · {snap_list['bytes'].fillna(0).sum() / 1024 / 1024:.1f} MB")
+            if not snap_list.empty:
+                st.dataframe(snap_list[['file_name', 'Date', 'rows', 'stale']], use_container_width=True, hide_index=True)
+                prune_dates = st.multiselect("清理月份", sorted(snap_list['Date'].astype(str).unique(), reverse=True), key='snap_prune')
+                if st.button("🗑️ 清理快照"):
+                    n_removed = snapshot_store.prune(dates=prune_dates)
+                    st.success(f"已清理 {n_removed} 个快照")
+
+    with st.expander("⚙️ 解析设置"):
+        parse_workers = st.number_input("并行进程数", min_value=1, max_value=32, value=DEFAULT_WORKERS, key='parse_workers')
+        parse_serial = st.checkbox("串行解析 (调试用)", value=False, key='parse_serial')
+        profile_on = st.checkbox("⏱️ 性能剖析模式", value=False, key='profile_on', help="记录各阶段耗时与行数")
+        profile_mem = st.checkbox("追踪峰值内存", value=False, key='profile_mem', disabled=not profile_on,
+                                  help="内存追踪是进程级的，开启期间同一服务上的所有会话都会变慢；与其他会话重叠的阶段不报告峰值")
+        history_mode = st.checkbox("💾 磁盘查询模式 (多年历史)", value=False, key='history_mode', disabled=not HAS_DUCKDB,
+                                   help="数据按 月份/服务商/部门 分区保存在本地磁盘，筛选与聚合由 DuckDB 完成，只加载结果集" if HAS_DUCKDB else "需要安装 duckdb")
+
+    # 本次运行的阶段计时；关闭时为空操作
+    profiler = Profiler(profile_on, trace_memory=profile_mem)
+
+    # 夜间批处理 (etl.py) 生成的预计算数据：直接按快照指纹载入，不需要上传
+    manifest = read_manifest(SNAPSHOT_DIR) if snapshot_store.enabled else None
+    use_etl = False
+    if manifest:
+        use_etl = st.checkbox(f"📦 载入预计算数据 ({len(manifest['files'])} 个文件 · {manifest['created']})", value=False, key='use_etl')
+
+    # 会话级数据集：只解析新增文件，移除的文件直接丢弃对应分区
+    # 磁盘模式下改为共享的历史库：上传的文件追加进去，历史分区一直保留
+    dataset = load_history(HISTORY_DIR) if history_mode else st.session_state.setdefault('dataset', DatasetManager())
+    batch = [(file.getvalue(), file.name) for file in uploaded_files or []]
+    keys = [file_key(file) for file in uploaded_files or []]
+    etl_keys = [f['key'] for f in manifest['files'] if not f.get('error')] if use_etl else []
+    todo = [keys.index(k) for k in dataset.missing(keys)]
+    loaded = {}
+    for k in dataset.missing(etl_keys):
+        df = snapshot_store.get(k)
+        if df is not None: loaded[k] = df
+    rec = profiler.start('load.parse', len(todo))
+    # 共享缓存里已有的解析结果 (其他会话上传过同一文件) 直接复用
+    for i in todo:
+        df = cache.get(('load', keys[i]))
+        if df is not None: loaded[keys[i]] = df
+    todo = [i for i in todo if keys[i] not in loaded]
+    if todo:
         my_bar = st.progress(0, text="正在解析...")
-        for i, file in enumerate(uploaded_files):
-            df = load_data_cached(file.getvalue(), file.name)
-            if not df.empty: dfs.append(df)
-            my_bar.progress((i + 1) / len(uploaded_files))
+        if parse_serial:
+            for j, i in enumerate(todo):
+                loaded[keys[i]] = load_data_cached(*batch[i], keys[i])
+                my_bar.progress((j + 1) / len(todo), text=batch[i][1])
+        else:
+            for done, (j, df) in enumerate(iter_load_files([batch[i] for i in todo], snapshot_store, workers=parse_workers, keys=[keys[i] for i in todo]), 1):
+                loaded[keys[todo[j]]] = cache.put(('load', keys[todo[j]]), df, group='load')
+                my_bar.progress(done / len(todo), text=batch[todo[j]][1])
         my_bar.empty()
-        st.success(f"✅ 已加载 {len(dfs)} 个文件")
+    profiler.stop(rec, rows_out=sum(len(df) for df in loaded.values()))
+    with profiler.stage('load.sync', sum(len(df) for df in loaded.values())) as rec:
+        dataset.sync(keys + etl_keys, loaded)
+        rec['rows_out'] = dataset.row_count
+
+    # 数据集恰好就是预计算的那批文件时，立方体/恶化清单直接用 etl.py 的产物，不再重算
+    etl_exact = use_etl and not history_mode and set(keys) <= set(etl_keys)
+    artifacts = cache.get_or_build(('etl', manifest['created']), lambda: read_artifacts(SNAPSHOT_DIR), group='etl') if etl_exact else {}
+
+    if history_mode:
+        with st.expander(f"💾 磁盘历史库：{dataset.file_count} 个分区 · {dataset.row_count:,} 行"):
+            # 历史库只追加；不再需要的月份在这里显式删除
+            hist_list = dataset.list()
+            if not hist_list.empty:
+                st.dataframe(hist_list[['Date', 'Provider', 'Dept', 'rows']], use_container_width=True, hide_index=True)
+                drop_dates = st.multiselect("删除月份", sorted(hist_list['Date'].dropna().unique(), reverse=True), key='hist_drop')
+                if st.button("🗑️ 删除分区", key='hist_drop_btn'):
+                    n_removed = dataset.remove(hist_list.loc[hist_list['Date'].isin(drop_dates), 'key'])
+                    st.success(f"已删除 {n_removed} 个分区")
+    if uploaded_files or use_etl:
+        st.success(f"✅ 已加载 {dataset.file_count} 个文件")
+
+        # 报告每个文件走的读取路径，便于发现扩展名与内容不符的导出文件
+        read_paths = [(file.name, dataset.formats.get(k)) for file, k in zip(uploaded_files or [], keys)]
+        mismatches = [m for m in (format_mismatch(n, f) for n, f in read_paths if f) if m]
+        if mismatches: st.warning("⚠️ 扩展名与内容不符：\n\n" + "\n\n".join(mismatches))
+        with st.expander("📑 读取路径"):
+            st.dataframe(pd.DataFrame(read_paths, columns=['文件', '格式']).fillna('解析失败'), use_container_width=True, hide_index=True)
 
 # ----------------------------------------------------
-# 🔧 工具函数：名称折叠 (截取前15个字符)
+# 派生结果缓存：键含数据集内容标识，数据变化后旧条目不再命中、随 LRU 淘汰
 # ----------------------------------------------------
-def truncate_name(name):
-    s = str(name)
-    if len(s) > 15:
-        return s[:15] + "..."
-    return s
-
-if not dfs:
+def dataset_cached(name, build):
+    return cache.get_or_build(('derived', dataset.identity, name), build, group='derived')
+
+def drift_for(sel, dates):
+    # 磁盘模式下相邻月份的连接下推到查询引擎，不物化明细
+    if history_mode: return dataset.drift(dates, **{k: v for k, v in sel.items() if k != 'Date'})
+    if artifacts.get('drift') is not None and sorted(map(str, dates)) == manifest['dates']:
+        # 每个 SKU×仓库 的恶化只取决于自己的历史：选中全部月份时按键筛选全量清单即可
+        return select(artifacts['drift'], **{k: v for k, v in sel.items() if k != 'Date'}).reset_index(drop=True)
+    return detect_drift(filters.frame(**sel), dates)
+
+if not dataset.file_count:
     st.info("👈 请在左侧上传数据文件")
 else:
-    full_df = pd.concat(dfs, ignore_index=True)
-    for col in ['Dept', 'Provider', 'Warehouse', 'Date']:
-        if col in full_df.columns: full_df[col] = full_df[col].astype(str)
+    cube = artifacts['cube'] if artifacts.get('cube') is not None else dataset.cube()
+    with profiler.stage('load.index', dataset.row_count):
+        # 磁盘模式：历史库自己就实现了 options/frame，查询直接下推
+        filters = dataset if history_mode else dataset_cached('filters', lambda: FilterEngine(dataset.frame()))
+
+    # SKU 查询：字典前缀/子串搜索，出现月份由行号索引直接给出，不扫描整表
+    with st.sidebar:
+        with st.expander("🔎 SKU 查询"):
+            sku_query = st.text_input("输入 SKU 或名称片段", key='sku_q')
+            if sku_query and not len(sku_dict):
+                st.caption("未加载字典")
+            elif sku_query:
+                hits = sku_dict.search(sku_query, limit=20)
+                months = filters.options_by('Date', 'SKU', hits['SKU'])
+                hits['出现月份'] = [', '.join(sorted(months[str(sku)])) or '-' for sku in hits['SKU']]
+                st.dataframe(hits, use_container_width=True, hide_index=True)
 
     tab1, tab2 = st.tabs(["📊 全景详情 (SKU级)", "🆚 历史趋势 & 风险洞察"])
     
     with tab1:
         try:
-            all_depts = sorted(full_df['Dept'].unique().tolist())
+            profiler.start('tab1.funnel')
+            all_depts = sorted(filters.options('Dept'))
             all_depts.insert(0, "全部汇总")
             c1, c2, c3, c4 = st.columns(4)
             with c1: sel_dept = st.selectbox("① 选择部门", all_depts, key='t1_d')
-            df_l1 = full_df if sel_dept == "全部汇总" else full_df[full_df['Dept'] == sel_dept]
+            dept_sel = None if sel_dept == "全部汇总" else sel_dept
 
-            avail_dates = sorted(df_l1['Date'].unique().tolist(), reverse=True)
+            avail_dates = sorted(filters.options('Date', Dept=dept_sel), reverse=True)
             with c2: sel_date = st.selectbox("② 选择月份 (基准)", avail_dates, key='t1_dt')
-            df_l2 = df_l1[df_l1['Date'] == sel_date]
 
-            avail_provs = sorted(df_l2['Provider'].unique().tolist())
+            avail_provs = sorted(filters.options('Provider', Dept=dept_sel, Date=sel_date))
             avail_provs.insert(0, "全部汇总")
             with c3: sel_prov = st.selectbox("③ 选择服务商", avail_provs, key='t1_p')
-            df_l3 = df_l2 if sel_prov == "全部汇总" else df_l2[df_l2['Provider'] == sel_prov]
+            prov_sel = None if sel_prov == "全部汇总" else sel_prov
                 
-            avail_whs = sorted(df_l3['Warehouse'].unique().tolist())
+            avail_whs = sorted(filters.options('Warehouse', Dept=dept_sel, Date=sel_date, Provider=prov_sel))
             with c4: sel_whs = st.multiselect("④ 选择仓库 (可多选)", avail_whs, default=avail_whs)
             
+            cube_sel = dict(Dept=dept_sel, Date=sel_date, Provider=prov_sel, Warehouse=sel_whs)
+            kpi_rec = profiler.start('tab1.kpi', len(cube))
             if not sel_whs:
                 st.warning("请至少选择一个仓库")
-                final_df = pd.DataFrame()
+                totals = None
             else:
-                final_df = df_l3[df_l3['Warehouse'].isin(sel_whs)]
+                totals = rollup(cube, **cube_sel)
             
-            if not final_df.empty:
+            if totals is not None and totals['Rows'] > 0:
                 wh_display = "多个仓库" if len(sel_whs) > 1 else sel_whs[0]
                 st.markdown(f"### 📋 数据视图：{sel_dept} · {sel_prov} · {wh_display}")
 
                 k1, k2, k3 = st.columns(3)
-                k1.metric("总库存 (Qty)", f"{final_df['Qty'].sum():,.0f}")
-                k2.metric("总体积 (Vol)", f"{final_df['Vol'].sum():,.2f} m³")
-                k3.metric("总费用 (Fee)", f"${final_df['Fee'].sum():,.2f}")
-                
-                summary = final_df.groupby('Age_Range').agg({'Fee':'sum','Qty':'sum','Vol':'sum'}).reset_index()
-                order_map = {l: i for i, l in enumerate(AGE_LABELS)}
-                summary['sort'] = summary['Age_Range'].map(order_map).fillna(999)
-                summary = summary.sort_values('sort').drop('sort', axis=1)
+                k1.metric("总库存 (Qty)", f"{totals['Qty']:,.0f}")
+                k2.metric("总体积 (Vol)", f"{totals['Vol']:,.2f} m³")
+                k3.metric("总费用 (Fee)", f"${totals['Fee']:,.2f}")
                 
-                total_fee = final_df['Fee'].sum()
-                total_vol = final_df['Vol'].sum()
-                summary['费用占比'] = (summary['Fee'] / total_fee * 100).fillna(0)
-                summary['体积占比'] = (summary['Vol'] / total_vol * 100).fillna(0)
+                summary = age_summary(cube, **cube_sel)
                 
                 st.dataframe(
                     summary.style.format({'Fee':'${:.2f}', 'Vol':'{:.2f}', '费用占比':'{:.1f}%', '体积占比':'{:.1f}%'}), 
                     use_container_width=True
                 )
+                profiler.stop(kpi_rec, rows_out=len(summary))
                 
                 st.divider()
                 st.markdown("#### 🔍 异常库存深钻 (含跨月追踪)")
                 
-                valid_ages = [l for l in AGE_LABELS if l in final_df['Age_Range'].unique()]
+                valid_ages = summary['Age_Range'].astype(str).tolist()
                 
                 if valid_ages:
                     r_col1, r_col2 = st.columns([3, 1])
@@ -286,65 +285,58 @@ else:
                             st.write("") 
                             show_agg = st.checkbox("🔀 SKU 宏观聚合", value=True, key="chk_agg_mode")
 
-                    other_dates = [d for d in full_df['Date'].unique() if d != sel_date]
+                    other_dates = [d for d in filters.options('Date') if d != sel_date]
                     other_dates.sort(reverse=True)
-                    target_month = st.selectbox("📅 开启下月追踪", ["关闭追踪"] + other_dates, index=0)
+                    track_months = st.multiselect("📅 开启跨月追踪 (可多选)", other_dates, default=[], key='t1_track')
 
-                    drill = final_df[final_df['Age_Range'] == rng].copy()
+                    drill_key = (selection_key(cube_sel), rng, show_agg)
+
+                    def build_base():
+                        if show_agg and history_mode:
+                            return dataset.sku_macro(sel_dept == "全部汇总", sel_prov == "全部汇总", Age_Range=rng, **cube_sel)
+                        if show_agg:
+                            # 宏观模式查预聚合索引：每个数据集版本构建一次，查询只与展示的 SKU 数相关
+                            index = dataset_cached('macro_index', lambda: SkuMacroIndex(dataset.frame()))
+                            return index.macro(Age_Range=rng, count_depts=sel_dept == "全部汇总", count_provs=sel_prov == "全部汇总", **cube_sel)
+                        drill = filters.frame(Age_Range=rng, **cube_sel)
+                        if drill.empty: return drill
+                        base_df = drill[['SKU', 'Warehouse', 'Qty', 'Vol', 'Fee', 'Age']].copy()
+                        # 不在这里排序：展示页由 ranked_positions 部分选择
+                        return base_df.reset_index(drop=True)
+
+                    drill_rec = profiler.start('tab1.drill')
+                    base_df = dataset_cached(('drill',) + drill_key, build_base)
+                    drill_rec['rows_out'] = len(base_df)
                     
-                    if drill.empty:
+                    if base_df.empty:
                         st.info("无数据")
                     else:
-                        if show_agg:
-                            base_df = drill.groupby('SKU').agg({
-                                'Qty': 'sum', 'Vol': 'sum', 'Fee': 'sum', 'Age': 'mean',
-                                'Warehouse': 'nunique', 'Dept': 'nunique', 'Provider': 'nunique'
-                            }).reset_index()
-                            def build_info(row):
-                                infos = []
-                                if sel_dept == "全部汇总" and row['Dept'] > 1: infos.append(f"{row['Dept']}个部门")
-                                if sel_prov == "全部汇总" and row['Provider'] > 1: infos.append(f"{row['Provider']}个服务商")
-                                infos.append(f"{row['Warehouse']}个仓")
-                                return " | ".join(infos)
-                            base_df['分布情况'] = base_df.apply(build_info, axis=1)
-                        else:
-                            base_df = drill[['SKU', 'Warehouse', 'Qty', 'Vol', 'Fee', 'Age']].copy()
-
-                        base_df = base_df.sort_values('Fee', ascending=False) 
+                        is_tracking = len(track_months) > 0
+                        merge_on = ['SKU'] if show_agg else ['SKU', 'Warehouse']
+                        current_total_vol = base_df['Vol'].sum()
 
-                        is_tracking = (target_month != "关闭追踪")
-                        
                         if is_tracking:
-                            mask_track = ((full_df['Date'] == target_month) & (full_df['SKU'].isin(base_df['SKU'])))
-                            if sel_dept != "全部汇总": mask_track &= (full_df['Dept'] == sel_dept)
-                            if sel_prov != "全部汇总": mask_track &= (full_df['Provider'] == sel_prov)
-                            if len(sel_whs) > 0: mask_track &= (full_df['Warehouse'].isin(sel_whs))
-                            
-                            track_raw = full_df[mask_track].copy()
-                            
-                            if show_agg:
-                                track_ready = track_raw.groupby('SKU').agg({'Qty': 'sum', 'Vol': 'sum', 'Fee': 'sum', 'Age': 'mean'}).reset_index()
-                                merge_on = ['SKU']
-                            else:
-                                track_ready = track_raw[['SKU', 'Warehouse', 'Qty', 'Vol', 'Fee', 'Age']]
-                                merge_on = ['SKU', 'Warehouse']
-
-                            final_show = pd.merge(base_df, track_ready, on=merge_on, suffixes=('', '_下月'), how='left')
-                            for col in ['Qty_下月', 'Vol_下月', 'Fee_下月', 'Age_下月']:
-                                final_show[col] = final_show[col].fillna(0)
-                                
-                            final_show['库存变化'] = final_show['Qty_下月'] - final_show['Qty']
-                            final_show['体积变化'] = final_show['Vol_下月'] - final_show['Vol']
-                            final_show['费用变化'] = final_show['Fee_下月'] - final_show['Fee']
-                            final_show['库龄增量'] = final_show['Age_下月'] - final_show['Age']
-                        else:
-                            final_show = base_df.copy()
-
-                        current_total_vol = base_df['Vol'].sum()
-                        if current_total_vol > 0:
-                            final_show['体积占比'] = (final_show['Vol'] / current_total_vol * 100)
-                        else:
-                            final_show['体积占比'] = 0
+                            # 所有其它月份的追踪宽表按 (筛选, 库龄段, 聚合模式) 缓存并按键建索引，每页只按键取行
+                            def build_track():
+                                wide = tracking_pivot(filters.frame(**{**cube_sel, 'Date': other_dates, 'SKU': base_df['SKU'].unique()}), merge_on)
+                                return wide.drop(columns=merge_on).set_axis(key_index(wide, merge_on), axis=0)
+                            track_wide = dataset_cached(('track',) + drill_key, build_track)
+                            track_cols = [f"{m}@{month}" for month in track_months for m in TRACK_AGG if f"{m}@{month}" in track_wide.columns]
+
+                        def with_tracking(rows):
+                            # 只为当前页 (或一个导出块) 补充追踪列和占比，不对整个库龄段做合并
+                            out = rows.reset_index(drop=True)
+                            if is_tracking:
+                                hit = track_wide[track_cols].reindex(key_index(out, merge_on))
+                                for col in track_cols: out[col] = hit[col].to_numpy()
+                            for month in track_months:
+                                for m, delta in [('Qty', '库存变化'), ('Vol', '体积变化'), ('Fee', '费用变化'), ('Age', '库龄增量')]:
+                                    col = f"{m}@{month}"
+                                    out[col] = out[col].fillna(0) if col in out.columns else 0.0
+                                    out[f"{delta}({month})"] = out[col] - out[m]
+                            out['体积占比'] = out['Vol'] / current_total_vol * 100 if current_total_vol > 0 else 0
+                            return out
+                        profiler.stop(drill_rec)
 
                         if show_agg:
                             base_cols = ['SKU', '分布情况', 'Qty', 'Vol', 'Fee', 'Age', '体积占比']
@@ -354,55 +346,80 @@ else:
                             rename_map = {'Qty':'库存(基准)', 'Vol':'体积(基准)', 'Fee':'费用(基准)', 'Age':'库龄(基准)'}
                         
                         cols_order = base_cols.copy()
-                        if is_tracking:
-                            cols_order.extend(['Qty_下月', '库存变化', 'Vol_下月', '体积变化', 'Fee_下月', '费用变化', 'Age_下月', '库龄增量'])
+                        for month in track_months:
+                            cols_order.extend([f'Qty@{month}', f'库存变化({month})', f'Vol@{month}', f'体积变化({month})',
+                                               f'Fee@{month}', f'费用变化({month})', f'Age@{month}', f'库龄增量({month})'])
                             rename_map.update({
-                                'Qty_下月': f'库存({target_month})', 'Vol_下月': f'体积({target_month})',
-                                'Fee_下月': f'费用({target_month})', 'Age_下月': f'库龄({target_month})'
+                                f'Qty@{month}': f'库存({month})', f'Vol@{month}': f'体积({month})',
+                                f'Fee@{month}': f'费用({month})', f'Age@{month}': f'库龄({month})'
                             })
 
-                        # 生成全量用于下载 (包含完整中文名)
-                        display_df_full = final_show[cols_order].copy()
-                        if sku_map:
-                            display_df_full.insert(1, '产品名称', display_df_full['SKU'].astype(str).str.strip().map(sku_map).fillna('-'))
-                        else:
-                            display_df_full.insert(1, '产品名称', '-')
-                        
-                        display_df_full = display_df_full.rename(columns=rename_map)
+                        def export_frame(chunk):
+                            # 导出按块补充追踪列、完整中文名并改列名，只在生成导出文件时执行
+                            out = with_tracking(chunk)[cols_order]
+                            out.insert(1, '产品名称', sku_dict.lookup(out['SKU']))
+                            return out.rename(columns=rename_map)
+
+                        sort_opts = {'Fee': '费用', 'Qty': '库存', 'Vol': '体积', 'Age': '库龄'}
+                        p1, p2, p3, p4 = st.columns([2, 1, 1, 1])
+                        with p1: sort_col = st.radio("排序依据", list(sort_opts), format_func=sort_opts.get, horizontal=True, key='t1_sort')
+                        with p2: ascending = st.checkbox("升序", value=False, key='t1_asc')
+                        with p3: page_size = st.selectbox("每页行数", [50, 100, 200], key='t1_ps')
+                        n_pages = max(1, -(-len(base_df) // page_size))
+                        if st.session_state.get('t1_page', 1) > n_pages: st.session_state['t1_page'] = 1
+                        with p4: page = st.number_input(f"页码 (共 {n_pages} 页)", min_value=1, max_value=n_pages, value=1, step=1, key='t1_page')
 
                         col_h1, col_h2 = st.columns([3, 1])
                         with col_h1:
-                            st.write(f"📊 **TOP 50 重点 SKU 分析** {'(含 ' + target_month + ' 追踪数据)' if is_tracking else ''}")
+                            st.write(f"📊 **重点 SKU 分析** (共 {len(base_df):,} 行 · 第 {page}/{n_pages} 页) {'(含 ' + '、'.join(track_months) + ' 追踪数据)' if is_tracking else ''}")
                         with col_h2:
-                            csv_data = display_df_full.to_csv(index=False).encode('utf-8-sig')
-                            st.download_button(
-                                label="📥 下载完整分析表 (所有SKU)",
-                                data=csv_data,
-                                file_name=f"库存分析_{sel_date}_{rng}.csv",
-                                mime="text/csv",
-                                key='dl_btn'
-                            )
-
-                        # 生成显示用视图 (包含折叠后的中文名)
-                        display_df_view = display_df_full.head(50).copy()
-                        # 🔧 优化点：对显示用的名称进行折叠
-                        display_df_view['产品名称'] = display_df_view['产品名称'].apply(truncate_name)
+                            export_fmt = st.radio("导出格式", ['csv', 'xlsx'], horizontal=True, key='dl_fmt',
+                                                  format_func=lambda f: 'CSV' if f == 'csv' else 'Excel (多表)')
+                            # 生成的文件放进按字节计量的共享缓存 (不占会话状态)，下载后即失效
+                            export_key = ('export', dataset.identity) + drill_key + (tuple(track_months), sort_col, ascending, export_fmt)
+                            ready = cache.get(export_key)
+                            if ready is None and st.button("📦 生成完整分析表", key='dl_build'):
+                                ranked = base_df.take(ranked_positions(base_df[sort_col].to_numpy(), len(base_df), 0, ascending))
+                                sheets = [('SKU明细', ranked, export_frame)]
+                                if export_fmt == 'xlsx':
+                                    sheets.insert(0, ('库龄结构', summary, None))
+                                    if is_tracking:
+                                        drift_dates = [sel_date] + list(track_months)
+                                        drift_sel = {**cube_sel, 'Date': drift_dates}
+                                        drift = dataset_cached(('drift',) + selection_key(drift_sel),
+                                                               lambda: drift_for(drift_sel, drift_dates))
+                                        sheets.append(('恶化清单', drift, None))
+                                with st.spinner("正在生成..."), profiler.stage('tab1.export', len(base_df)):
+                                    ready = cache.put(export_key, export_file(export_fmt, sheets), group='export')
+                            if ready is not None:
+                                st.download_button(
+                                    label="📥 下载完整分析表 (所有SKU)",
+                                    data=ready,
+                                    file_name=f"库存分析_{sel_date}_{rng}.{export_fmt}",
+                                    mime=EXPORT_MIME[export_fmt],
+                                    key='dl_btn',
+                                    on_click=cache.invalidate, kwargs={'key': export_key},
+                                )
+
+                        # 生成显示用视图：只取当前页的行，样式也只作用于这一页
+                        table_rec = profiler.start('tab1.table', len(base_df))
+                        page_pos = ranked_positions(base_df[sort_col].to_numpy(), page * page_size, (page - 1) * page_size, ascending)
+                        display_df_view = with_tracking(base_df.take(page_pos))[cols_order]
+                        # 🔧 优化点：对显示用的名称进行折叠 (字典里预先折叠好)
+                        display_df_view.insert(1, '产品名称', sku_dict.lookup(display_df_view['SKU'], short=True))
+                        display_df_view = display_df_view.rename(columns=rename_map)
 
                         def style_tracking(styler):
                             fmt_dict = {
                                 '费用(基准)': '${:.2f}', '体积(基准)': '{:.2f}', '库龄(基准)': '{:.0f}', '体积占比': '{:.1f}%',
                                 '库存(基准)': '{:.0f}'
                             }
-                            if is_tracking:
-                                next_qty_col = f'库存({target_month})'
-                                next_vol_col = f'体积({target_month})'
-                                next_fee_col = f'费用({target_month})'
-                                next_age_col = f'库龄({target_month})'
+                            for month in track_months:
                                 fmt_dict.update({
-                                    next_qty_col: '{:.0f}', '库存变化': '{:.0f}',
-                                    next_vol_col: '{:.2f}', '体积变化': '{:.2f}',
-                                    next_fee_col: '${:.2f}', '费用变化': '${:.2f}',
-                                    next_age_col: '{:.0f}', '库龄增量': '{:.0f}'
+                                    f'库存({month})': '{:.0f}', f'库存变化({month})': '{:.0f}',
+                                    f'体积({month})': '{:.2f}', f'体积变化({month})': '{:.2f}',
+                                    f'费用({month})': '${:.2f}', f'费用变化({month})': '${:.2f}',
+                                    f'库龄({month})': '{:.0f}', f'库龄增量({month})': '{:.0f}'
                                 })
                             
                             styler = styler.format(fmt_dict)
@@ -417,93 +434,133 @@ else:
                                     if v < 0: return 'background-color: #e6ffe6; color: green'
                                     if v > 0: return 'background-color: #ffe6e6; color: red'
                                     return ''
-                                styler = styler.applymap(highlight_good_bad, subset=['库存变化', '体积变化'])
-                                styler = styler.applymap(highlight_fee_diff, subset=['费用变化'])
+                                good_bad_cols = [f'{d}({month})' for month in track_months for d in ['库存变化', '体积变化']]
+                                styler = styler.applymap(highlight_good_bad, subset=good_bad_cols)
+                                styler = styler.applymap(highlight_fee_diff, subset=[f'费用变化({month})' for month in track_months])
                             return styler
 
                         st.dataframe(style_tracking(display_df_view.style), use_container_width=True, height=600)
+                        profiler.stop(table_rec, rows_out=len(display_df_view))
                 else:
                     st.warning("该筛选条件下无数据")
         except Exception as e:
+            profiler.fail(e)
             st.error(f"⚠️ 界面渲染发生错误: {str(e)}")
 
     with tab2:
         try:
+            profiler.start('tab2.funnel')
             st.markdown("#### 🆚 历史趋势 & 风险洞察")
             cc1, cc2, cc3 = st.columns(3)
-            with cc1: t_dept = st.selectbox("分析部门", sorted(list(set(full_df['Dept']) | {"全部汇总"})), key='t2_d')
-            df_t1 = full_df if t_dept == "全部汇总" else full_df[full_df['Dept'] == t_dept]
+            with cc1: t_dept = st.selectbox("分析部门", sorted(filters.options('Dept') + ["全部汇总"]), key='t2_d')
+            t_dept_sel = None if t_dept == "全部汇总" else t_dept
 
-            with cc2: t_prov = st.selectbox("分析服务商", sorted(list(set(df_t1['Provider']) | {"全部汇总"})), key='t2_p')
-            df_t2 = df_t1 if t_prov == "全部汇总" else df_t1[df_t1['Provider'] == t_prov]
+            with cc2: t_prov = st.selectbox("分析服务商", sorted(filters.options('Provider', Dept=t_dept_sel) + ["全部汇总"]), key='t2_p')
+            t_prov_sel = None if t_prov == "全部汇总" else t_prov
 
-            with cc3: t_whs = st.multiselect("分析仓库", sorted(df_t2['Warehouse'].unique()), default=sorted(df_t2['Warehouse'].unique()), key='t2_w')
+            t_avail_whs = sorted(filters.options('Warehouse', Dept=t_dept_sel, Provider=t_prov_sel))
+            with cc3: t_whs = st.multiselect("分析仓库", t_avail_whs, default=t_avail_whs, key='t2_w')
             
             if not t_whs:
                 st.warning("请至少选择一个仓库")
             else:
-                t_final = df_t2[df_t2['Warehouse'].isin(t_whs)]
-                avail_dates = sorted(t_final['Date'].unique())
+                avail_dates = sorted(filters.options('Date', Dept=t_dept_sel, Provider=t_prov_sel, Warehouse=t_whs))
                 selected_dates = st.multiselect("选择分析月份", avail_dates, default=avail_dates)
                 
                 if len(selected_dates) > 0:
-                    chart_df = t_final[t_final['Date'].isin(selected_dates)]
-                    
                     st.divider()
-                    agg_df = chart_df.groupby(['Date', 'Age_Range']).agg({'Qty': 'sum', 'Fee': 'sum', 'Vol': 'sum'}).reset_index()
+                    t_sel = dict(Dept=t_dept_sel, Provider=t_prov_sel, Warehouse=t_whs, Date=selected_dates)
+                    split_opts = {'': '不拆分', 'Provider': '按服务商', 'Warehouse': '按仓库', 'Dept': '按部门'}
+                    t_by = st.radio("趋势拆分", list(split_opts), format_func=split_opts.get, horizontal=True, key='t2_split') or None
+
+                    # 全部 KPI / 图表数据来自同一次分组计算，按筛选状态缓存
+                    rec = profiler.start('tab2.trend', len(cube))
+                    trend = dataset_cached(('trend', selection_key(t_sel), t_by), lambda: trend_metrics(cube, by=t_by, **t_sel))
+                    kpis, agg_df = trend['total'], trend['ages']
+                    profiler.stop(rec, rows_out=len(kpis))
+
+                    if len(kpis):
+                        latest = kpis.iloc[-1]
+                        def delta(col, fmt):
+                            v = latest[f'{col}环比']
+                            return None if pd.isna(v) else fmt.format(v)
+                        m1, m2, m3, m4 = st.columns(4)
+                        m1.metric("单位仓租成本 (CPU)", f"{latest['CPU']:.3f}", delta('CPU', '{:+.3f}'), delta_color='inverse')
+                        m2.metric("潜在节省 (360天+ 费用)", f"${latest['潜在节省']:,.2f}", delta('潜在节省', '{:+,.2f}'), delta_color='inverse')
+                        m3.metric("360天+ 费用占比", f"{latest[f'费用占比@{AGE_LABELS[-1]}']:.1f}%")
+                        m4.metric("总费用 (Fee)", f"${latest['Fee']:,.2f}", delta('Fee', '{:+,.2f}'), delta_color='inverse')
+
+                    rec = profiler.start('tab2.volume_chart', len(agg_df))
                     base_bar = alt.Chart(agg_df).encode(x=alt.X('Age_Range', sort=AGE_LABELS), y=alt.Y('Vol'), color='Date', tooltip=['Date', 'Age_Range', 'Vol'])
                     bars = base_bar.mark_bar().encode(xOffset='Date')
                     text = base_bar.mark_text(align='center', baseline='bottom', dy=-5).encode(xOffset='Date', text=alt.Text('Vol', format='.1f'))
                     st.altair_chart((bars+text).properties(height=400), use_container_width=True)
+
+                    fee_stack = alt.Chart(agg_df).mark_bar().encode(
+                        x='Date', y=alt.Y('Fee', stack='zero'), color=alt.Color('Age_Range', sort=AGE_LABELS),
+                        order=alt.Order('Age_Range', sort='ascending'),
+                        tooltip=['Date', 'Age_Range', alt.Tooltip('Fee', format=',.2f'), alt.Tooltip('费用占比', format='.1f')])
+                    st.altair_chart(fee_stack.properties(height=350), use_container_width=True)
+                    profiler.stop(rec, rows_out=len(agg_df))
                     
                     st.divider()
-                    cpu_trend = chart_df.groupby('Date').apply(lambda x: pd.Series({'CPU': x['Fee'].sum() / x['Qty'].sum() if x['Qty'].sum() > 0 else 0})).reset_index()
-                    base_line = alt.Chart(cpu_trend).encode(x='Date', y='CPU', tooltip=['Date', alt.Tooltip('CPU', format='.3f')])
-                    line = base_line.mark_line(point=True)
-                    line_text = base_line.mark_text(align='left', dx=5, dy=-5).encode(text=alt.Text('CPU', format='.3f'))
-                    st.altair_chart((line+line_text).properties(height=350), use_container_width=True)
+                    rec = profiler.start('tab2.cpu_chart', len(kpis))
+                    roll_col = next(c for c in kpis.columns if c.startswith('CPU滚动'))
+                    if t_by:
+                        cpu_trend = trend['breakdown']
+                        line = alt.Chart(cpu_trend).mark_line(point=True).encode(
+                            x='Date', y='CPU', color=t_by, tooltip=['Date', t_by, alt.Tooltip('CPU', format='.3f'), alt.Tooltip('CPU环比%', format='+.1f')])
+                        st.altair_chart(line.properties(height=350), use_container_width=True)
+                    else:
+                        cpu_trend = kpis
+                        base_line = alt.Chart(cpu_trend).encode(x='Date', y='CPU', tooltip=['Date', alt.Tooltip('CPU', format='.3f'), alt.Tooltip('CPU环比%', format='+.1f')])
+                        line = base_line.mark_line(point=True)
+                        line_text = base_line.mark_text(align='left', dx=5, dy=-5).encode(text=alt.Text('CPU', format='.3f'))
+                        rolling = alt.Chart(cpu_trend).mark_line(strokeDash=[4, 4], color='gray').encode(x='Date', y=roll_col)
+                        st.altair_chart((line+line_text+rolling).properties(height=350), use_container_width=True)
+                    profiler.stop(rec, rows_out=len(cpu_trend))
 
                     st.divider()
                     st.markdown("#### 🚨 恶化监控 (智能聚合版)")
                     if len(selected_dates) >= 2:
-                        sorted_dates = sorted(selected_dates)
-                        curr, prev = sorted_dates[-1], sorted_dates[-2]
-                        group_cols = ['SKU', 'Warehouse', 'Dept', 'Provider']
+                        drift_key = ('drift', t_dept, t_prov, tuple(t_whs), tuple(sorted(selected_dates)))
+                        rec = profiler.start('tab2.drift')
+                        drift = dataset_cached(drift_key, lambda: drift_for(t_sel, selected_dates))
+                        rec['rows_out'] = len(drift)
                         
-                        df_c_raw = chart_df[chart_df['Date'] == curr]
-                        df_p_raw = chart_df[chart_df['Date'] == prev]
-
-                        df_c_agg = df_c_raw.groupby(group_cols + ['Age_Range'])['Fee'].sum().reset_index()
-                        df_p_agg = df_p_raw.groupby(group_cols + ['Age_Range'])['Fee'].sum().reset_index()
-
-                        merged = pd.merge(df_p_agg, df_c_agg, on=group_cols, suffixes=('_old', '_new'))
-                        merged['i_old'] = merged['Age_Range_old'].map(AGE_MAP).fillna(-1)
-                        merged['i_new'] = merged['Age_Range_new'].map(AGE_MAP).fillna(-1)
-                        
-                        bad_raw = merged[merged['i_new'] == merged['i_old'] + 1].copy()
-                        
-                        if bad_raw.empty:
+                        if drift.empty:
                             st.success("🎉 无恶化")
                         else:
-                            bad_final = bad_raw.groupby(['SKU', 'Dept', 'Warehouse', 'Age_Range_old', 'Age_Range_new'])['Fee_new'].sum().reset_index()
-                            bad_final.rename(columns={'Fee_new': 'Fee'}, inplace=True)
-                            
-                            if sku_map:
-                                bad_final.insert(1, '产品名称', bad_final['SKU'].astype(str).str.strip().map(sku_map).fillna('-'))
-                            else:
-                                bad_final.insert(1, '产品名称', '-')
+                            sort_by = st.radio("排序依据", ['Fee', '连续恶化', '跳档'], horizontal=True, key='t2_drift_sort')
+                            show = drift.sort_values([sort_by, 'Fee'], ascending=False).head(20).reset_index(drop=True)
                             
                             # 🔧 优化点：恶化表也折叠名称
-                            bad_final['产品名称'] = bad_final['产品名称'].apply(truncate_name)
-
-                            bad_final['Fee'] = bad_final['Fee'].astype(float)
-                            show = bad_final.sort_values('Fee', ascending=False).head(20)
+                            show.insert(1, '产品名称', sku_dict.lookup(show['SKU'], short=True))
                             
+                            st.caption(f"共 {len(drift)} 个 SKU×仓库 出现恶化 (覆盖 {len(selected_dates)} 个月的所有相邻月份)")
                             st.dataframe(
                                 show.style.format({'Fee':'${:.2f}'}).background_gradient(subset=['Fee'], cmap='Reds'),
                                 use_container_width=True
                             )
+                        profiler.stop(rec)
                 else:
                     st.info("请至少选择一个月份")
         except Exception as e:
-            st.error(f"趋势图表渲染错误: {str(e)}")
\ No newline at end of file
+            profiler.fail(e)
+            st.error(f"趋势图表渲染错误: {str(e)}")
+
+# ----------------------------------------------------
+# 性能剖析面板：本次运行的各阶段耗时 + 每个文件的解析统计
+# ----------------------------------------------------
+if profiler.enabled:
+    profiler.close()
+    with st.sidebar:
+        with st.expander("⏱️ 性能剖析", expanded=True):
+            stages = profiler.frame()
+            st.caption(f"本次运行 {stages['seconds'].sum():.2f}s · 峰值内存 {stages['peak_mb'].fillna(0).max():.1f} MB")
+            st.dataframe(stages, use_container_width=True, hide_index=True)
+            file_stats = list(dataset.load_stats.values())
+            if file_stats:
+                st.dataframe(file_frame(file_stats), use_container_width=True, hide_index=True)
+            st.download_button("📤 导出剖析 JSON", profiler.to_json(file_stats),
+                               file_name=f"profile_{time.strftime('%Y%m%d_%H%M%S')}.json", mime="application/json", key='profile_dl')
\ No newline at end of file
@@ -0,0 +1,134 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+from analytics import detect_drift, ranked_positions, tracking_pivot
+from dataset import DatasetManager, FilterEngine, SkuMacroIndex
+from ingest import COLUMN_MAPS, PARSER_VERSION, load_inventory_file
+from snapshot_store import SnapshotStore
+from synth import DEFAULT_DEPTS, generate
+
+# ================= 性能基准 =================
+# 用合成文件按总行数分档计时各热点阶段，结果追加到 JSONL，便于跨版本对比
+DEFAULT_SIZES = [10000, 100000, 1000000]
+RESULTS_PATH = os.path.join('.bench', 'results.jsonl')
+
+def _git_rev():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+class Timer:
+    def __init__(self):
+        self.records = []
+
+    @contextmanager
+    def stage(self, name, rows=None):
+        t0 = time.perf_counter()
+        yield
+        self.records.append({'stage': name, 'seconds': round(time.perf_counter() - t0, 4), 'rows': rows})
+
+def run_size(total_rows, work_dir, months=3, depts=DEFAULT_DEPTS, fmt='csv', encoding='utf-8-sig', repeat=1):
+    # total_rows 平均分到 部门 × 服务商 × 月份 个文件
+    n_files = len(depts) * len(COLUMN_MAPS) * months
+    rows = max(total_rows // n_files, 1)
+    data_dir = os.path.join(work_dir, f"data-{total_rows}-{fmt}")
+    if not os.path.isdir(data_dir) or not os.listdir(data_dir):
+        generate(data_dir, rows=rows, months=months, depts=depts, fmt=fmt, encoding=encoding)
+    files = []
+    for name in sorted(os.listdir(data_dir)):
+        with open(os.path.join(data_dir, name), 'rb') as f: files.append((f.read(), name))
+
+    timer = Timer()
+    for _ in range(repeat):
+        # 冷解析 = load_data_cached 首次调用；热读取 = 命中 Parquet 快照
+        with timer.stage('parse_cold', total_rows):
+            frames = [load_inventory_file(c, n) for c, n in files]
+        store = SnapshotStore(os.path.join(work_dir, 'snapshots'), PARSER_VERSION)
+        if store.enabled:
+            keys = [store.key(c, n) for c, n in files]
+            for k, df, (_, n) in zip(keys, frames, files): store.put(k, df, n)
+            with timer.stage('parse_snapshot', total_rows):
+                for c, n in files: load_inventory_file(c, n, store)
+            for k in keys: store.evict(k)
+
+        with timer.stage('concat', total_rows):
+            dataset = DatasetManager()
+            dataset.sync(list(range(len(frames))), dict(enumerate(frames)))
+            full_df = dataset.frame()
+        with timer.stage('cube', total_rows):
+            dataset.cube()
+
+        dates = sorted(full_df['Date'].cat.categories.astype(str))
+        with timer.stage('funnel_index', len(full_df)):
+            filters = FilterEngine(full_df)
+        with timer.stage('funnel_filter', len(full_df)):
+            dept = filters.options('Dept')[0]
+            date = sorted(filters.options('Date', Dept=dept))[-1]
+            prov = filters.options('Provider', Dept=dept, Date=date)[0]
+            whs = filters.options('Warehouse', Dept=dept, Date=date, Provider=prov)
+            sel = dict(Dept=dept, Date=date, Provider=prov, Warehouse=whs)
+            filters.frame(**sel)
+
+        # 宏观聚合 = 看板的 SkuMacroIndex：每个数据集版本构建一次，之后每次切换只查询
+        with timer.stage('macro_index', len(full_df)):
+            macro = SkuMacroIndex(full_df)
+        age = filters.options('Age_Range', Date=date)[-1]
+        with timer.stage('drill_agg', len(filters.positions(Date=date, Age_Range=age))):
+            base = macro.macro(Date=date, Age_Range=age, count_depts=True, count_provs=True)
+            ranked_positions(base['Fee'].to_numpy(), 50)
+        with timer.stage('tracking', len(full_df)):
+            others = [d for d in dates if d != date]
+            tracking_pivot(filters.frame(Date=others, SKU=base['SKU'].unique()), ['SKU'])
+        with timer.stage('drift', len(full_df)):
+            detect_drift(full_df, dates)
+    return timer.records
+
+def summarize(records):
+    # 多次重复取中位数
+    by_stage = {}
+    for r in records: by_stage.setdefault(r['stage'], []).append(r)
+    return [{'stage': s, 'seconds': float(np.median([r['seconds'] for r in rs])), 'rows': rs[0]['rows']}
+            for s, rs in by_stage.items()]
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="按数据规模计时加载、合并、筛选、深钻/追踪与恶化检测")
+    ap.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help="总行数档位")
+    ap.add_argument('--months', type=int, default=3)
+    ap.add_argument('--format', dest='fmt', choices=['xlsx', 'csv'], default='csv')
+    ap.add_argument('--encoding', default='utf-8-sig')
+    ap.add_argument('--repeat', type=int, default=1)
+    ap.add_argument('--work-dir', default=None, help="合成文件目录 (保留可复用)；默认临时目录")
+    ap.add_argument('--out', default=RESULTS_PATH, help="结果追加写入的 JSONL 文件")
+    args = ap.parse_args(argv)
+
+    tmp = None
+    work_dir = args.work_dir
+    if not work_dir:
+        tmp = tempfile.TemporaryDirectory()
+        work_dir = tmp.name
+    run = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'rev': _git_rev(), 'python': platform.python_version(),
+           'format': args.fmt, 'encoding': args.encoding, 'months': args.months}
+    try:
+        os.makedirs(os.path.dirname(args.out) or '.', exist_ok=True)
+        with open(args.out, 'a', encoding='utf-8') as out:
+            for size in args.sizes:
+                for r in summarize(run_size(size, work_dir, args.months, fmt=args.fmt,
+                                            encoding=args.encoding, repeat=args.repeat)):
+                    rec = {**run, 'size': size, **r}
+                    out.write(json.dumps(rec, ensure_ascii=False) + '\n')
+                    print(f"{size:>9,}  {r['stage']:<16} {r['seconds']:>9.4f}s")
+    finally:
+        if tmp: tmp.cleanup()
+
+if __name__ == '__main__':
+    main()
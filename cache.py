@@ -0,0 +1,127 @@
+import hashlib
+import io
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+# ================= 按内存预算的 LRU 缓存 =================
+# 取代 st.cache_data(ttl=3600)：条目按字节计量，超出预算时淘汰最久未用的条目；
+# 进程内所有会话共享，可按条目/分组失效，并统计命中率
+SAMPLE_THRESHOLD = 4 * 1024 * 1024
+SAMPLE_CHUNK = 64 * 1024
+SAMPLE_COUNT = 16
+
+def fingerprint(file_content, file_name=''):
+    # 小文件全量哈希；大文件只哈希 大小 + 均匀分布的 16 个 64KB 块，避免每次重跑都扫完整个文件
+    n = len(file_content)
+    h = hashlib.blake2b(digest_size=16)
+    h.update(file_name.encode('utf-8'))
+    h.update(n.to_bytes(8, 'little'))
+    view = memoryview(file_content)
+    if n <= SAMPLE_THRESHOLD:
+        h.update(view)
+    else:
+        step = (n - SAMPLE_CHUNK) // (SAMPLE_COUNT - 1)
+        for i in range(SAMPLE_COUNT): h.update(view[i * step:i * step + SAMPLE_CHUNK])
+    return h.hexdigest()
+
+def sizeof(obj):
+    # 估算缓存条目占用的字节数
+    if obj is None: return 0
+    if isinstance(obj, pd.DataFrame): return int(obj.memory_usage(index=True, deep=True).sum())
+    if isinstance(obj, (pd.Series, pd.Index)): return int(obj.memory_usage(deep=True))
+    if isinstance(obj, np.ndarray): return int(obj.nbytes)
+    if isinstance(obj, (bytes, bytearray)): return len(obj)
+    if isinstance(obj, io.BytesIO): return obj.getbuffer().nbytes
+    if hasattr(obj, 'nbytes'): return int(obj.nbytes)
+    if isinstance(obj, dict): return sys.getsizeof(obj) + sum(sizeof(k) + sizeof(v) for k, v in obj.items())
+    if isinstance(obj, (list, tuple)): return sys.getsizeof(obj) + sum(sizeof(v) for v in obj)
+    return sys.getsizeof(obj)
+
+class MemoryCache:
+    def __init__(self, budget_bytes):
+        self.budget = int(budget_bytes)
+        self.bytes = 0
+        self.hits = self.misses = self.evictions = self.rejected = 0
+        self._entries = OrderedDict()  # key -> [value, 字节数, 分组, 命中次数, 写入时间]
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            entry[3] += 1
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, group=None, size=None):
+        size = sizeof(value) if size is None else size
+        with self._lock:
+            self._discard(key)
+            # 单个条目超过整个预算时不缓存，否则会把其他条目全部挤掉
+            if size > self.budget:
+                self.rejected += 1
+                return value
+            while self._entries and self.bytes + size > self.budget:
+                _, old = self._entries.popitem(last=False)
+                self.bytes -= old[1]
+                self.evictions += 1
+            self._entries[key] = [value, size, group, 0, time.time()]
+            self.bytes += size
+        return value
+
+    def get_or_build(self, key, build, group=None):
+        # 构建在锁外进行；并发会话同时未命中时可能重复构建一次，结果相同
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing: value = self.put(key, build(), group)
+        return value
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None: self.bytes -= entry[1]
+        return entry is not None
+
+    def invalidate(self, key=None, group=None):
+        # 按键或按分组失效；都不传时清空
+        with self._lock:
+            if key is None and group is None:
+                n = len(self._entries)
+                self._entries.clear()
+                self.bytes = 0
+                return n
+            if key is not None: return int(self._discard(key))
+            keys = [k for k, e in self._entries.items() if e[2] == group]
+            for k in keys: self._discard(k)
+            return len(keys)
+
+    def clear(self):
+        return self.invalidate()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'entries': len(self._entries), 'bytes': self.bytes, 'budget': self.budget,
+            'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / total if total else 0.0,
+            'evictions': self.evictions, 'rejected': self.rejected,
+        }
+
+    def entries(self):
+        # 按最近使用排序 (最新在前)
+        with self._lock:
+            rows = [{'key': k, 'group': e[2], 'MB': e[1] / 2 ** 20, 'hits': e[3], 'age_s': time.time() - e[4]}
+                    for k, e in reversed(self._entries.items())]
+        return pd.DataFrame(rows, columns=['key', 'group', 'MB', 'hits', 'age_s'])
@@ -0,0 +1,278 @@
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+from analytics import build_cube, distribution_labels
+from ingest import AGE_LABELS
+
+# ================= 合并数据集的紧凑表示 =================
+# 低基数维度存为分类编码；库龄段为有序分类，排序/比较直接按 AGE_LABELS 顺序
+AGE_DTYPE = pd.CategoricalDtype(AGE_LABELS, ordered=True)
+DIM_COLS = ['Dept', 'Provider', 'Warehouse', 'Date']
+# Qty/Age 为整数值，单行在 float32 下精确 (< 2^24)；汇总会超过这个范围，聚合前由 analytics.widen 转 float64。
+# Fee/Vol 为小数，汇总时 float32 会在第二位小数上产生偏差，保留 float64
+FLOAT32_COLS = ['Qty', 'Age']
+
+def compact_frame(df):
+    df = df.copy(deep=False)
+    for col in DIM_COLS:
+        if col in df.columns: df[col] = df[col].astype(str).astype('category')
+    if 'Age_Range' in df.columns: df['Age_Range'] = df['Age_Range'].astype(AGE_DTYPE)
+    # SKU 编码化 = 字符串驻留，同一 SKU 在各月份只存一份
+    if 'SKU' in df.columns: df['SKU'] = df['SKU'].astype('category')
+    for col in FLOAT32_COLS:
+        if col in df.columns: df[col] = df[col].astype('float32')
+    return df
+
+def concat_compact(frames):
+    # 拼接紧凑分区：无序分类列先统一为排序后的并集类别，拼接后仍为分类编码
+    frames = [f for f in frames if f is not None and len(f)]
+    if not frames: return None
+    if len(frames) == 1: return frames[0]
+    frames = list(frames)
+    for col in DIM_COLS + ['SKU']:
+        cats = frames[0][col].cat.categories
+        for f in frames[1:]: cats = cats.union(f[col].cat.categories)
+        for i, f in enumerate(frames):
+            if not f[col].cat.categories.equals(cats):
+                frames[i] = f.assign(**{col: f[col].cat.set_categories(cats)})
+    return pd.concat(frames, ignore_index=True)
+
+# ================= 增量数据集管理 =================
+# 按文件指纹持有分区：新增文件只解析/压缩该文件，移除文件只丢弃对应分区；
+# 合并表在第一次 frame() 时才拼接，增删文件本身不复制全部历史。
+# version 在内容变化时递增，下游缓存以此为键
+class DatasetManager:
+    def __init__(self):
+        self.version = 0
+        self.identity = None
+        self.formats = {}
+        self.load_stats = {}
+        self._parts = {}
+        self._cubes = {}
+        self._order = []
+        self._frame = None
+        self._cube = None
+
+    def missing(self, keys):
+        return [k for k in dict.fromkeys(keys) if k not in self._parts]
+
+    def sync(self, keys, new_frames):
+        # keys: 当前上传的全部文件指纹；new_frames: {指纹: 解析结果}，只需包含 missing() 返回的文件
+        wanted = set(keys)
+        removed = [k for k in self._parts if k not in wanted]
+        added = [k for k in dict.fromkeys(keys) if k not in self._parts and k in new_frames]
+        if not removed and not added: return False
+
+        for k in removed:
+            self._parts.pop(k)
+            self._cubes.pop(k, None)
+            self.formats.pop(k, None)
+            self.load_stats.pop(k, None)
+        self._order = [k for k in self._order if k not in removed]
+
+        for k in added:
+            df = new_frames[k]
+            self.formats[k] = df.attrs.get('source_format')
+            self.load_stats[k] = df.attrs.get('load_stats')
+            if df.empty:
+                # 解析失败的文件也记住，避免每次重跑都重新解析
+                self._parts[k] = df
+                continue
+            part = compact_frame(df)
+            self._parts[k] = part
+            self._cubes[k] = build_cube(part)
+            self._order.append(k)
+
+        self._frame = self._cube = None
+        self.version += 1
+        # 内容标识 = 有效分区指纹序列：不同会话上传同一批文件时可以共用派生结果缓存
+        self.identity = hashlib.sha1('\n'.join(map(str, self._order)).encode('utf-8')).hexdigest()
+        return True
+
+    @property
+    def file_count(self):
+        return len(self._order)
+
+    @property
+    def row_count(self):
+        return sum(len(self._parts[k]) for k in self._order)
+
+    def frame(self):
+        # 按需拼接：同一版本只拼一次，分区仍单独保留供后续增删
+        if self._frame is None and self._order:
+            self._frame = concat_compact([self._parts[k] for k in self._order])
+        return self._frame
+
+    def cube(self):
+        # 立方体按分区增量维护，合并后只有维度组合数那么多行
+        if self._cube is None and self._order:
+            self._cube = pd.concat([self._cubes[k] for k in self._order], ignore_index=True)
+        return self._cube
+
+# ================= 级联筛选索引 =================
+# 每个维度按分类编码建一次行号索引；筛选 = 索引求交，不扫描整表也不复制
+FILTER_DIMS = ['Dept', 'Date', 'Provider', 'Warehouse', 'Age_Range', 'SKU']
+
+class FilterEngine:
+    def __init__(self, df, dims=FILTER_DIMS):
+        self.df = df
+        self.n = len(df)
+        self._codes, self._cats, self._order, self._bounds = {}, {}, {}, {}
+        for dim in dims:
+            codes = df[dim].cat.codes.to_numpy()
+            order = np.argsort(codes, kind='stable')
+            self._codes[dim] = codes
+            self._cats[dim] = df[dim].cat.categories
+            self._order[dim] = order
+            # 编码 k 的行号 = order[bounds[k]:bounds[k+1]]，缺失值 (-1) 排在最前面被跳过
+            self._bounds[dim] = np.searchsorted(codes[order], np.arange(len(self._cats[dim]) + 1))
+
+    @property
+    def nbytes(self):
+        # 缓存计量：索引数组 + 所引用的数据集 (缓存可能是它唯一的持有者)
+        arrays = [*self._codes.values(), *self._order.values(), *self._bounds.values()]
+        return sum(a.nbytes for a in arrays) + int(self.df.memory_usage(deep=True).sum())
+
+    def _value_positions(self, dim, value):
+        values = list(value) if pd.api.types.is_list_like(value) else [value]
+        codes = self._cats[dim].get_indexer(pd.Index(np.asarray(values, dtype=object)).astype(str))
+        order, bounds = self._order[dim], self._bounds[dim]
+        parts = [order[bounds[k]:bounds[k + 1]] for k in np.unique(codes[codes >= 0])]
+        if not parts: return np.empty(0, dtype=np.intp)
+        return parts[0] if len(parts) == 1 else np.sort(np.concatenate(parts))
+
+    def _intersect(self, a, b):
+        # 引擎按数据集内容在会话 (线程) 间共享：标记数组每次调用单独分配，不共用可写缓冲区
+        if len(a) > len(b): a, b = b, a
+        mask = np.zeros(self.n, dtype=bool)
+        mask[b] = True
+        return a[mask[a]]
+
+    def positions(self, **sel):
+        # sel: 维度=取值 或 取值列表；None 表示不筛选。返回升序行号
+        pos = None
+        for dim, value in sel.items():
+            if value is None: continue
+            p = self._value_positions(dim, value)
+            pos = p if pos is None else self._intersect(pos, p)
+        return np.arange(self.n) if pos is None else pos
+
+    def options(self, dim, **sel):
+        # 上游选择下仍然存在的取值 (按分类顺序)
+        cats = self._cats[dim]
+        if all(v is None for v in sel.values()):
+            present = np.flatnonzero(np.diff(self._bounds[dim]) > 0)
+        else:
+            codes = self._codes[dim][self.positions(**sel)]
+            present = np.flatnonzero(np.bincount(codes[codes >= 0], minlength=len(cats)))
+        return cats[present].tolist()
+
+    def options_by(self, dim, by, values):
+        # {by 的取值: 该取值下出现的 dim 取值}；每个取值只查一次行号索引
+        return {str(v): self.options(dim, **{by: v}) for v in values}
+
+    def frame(self, columns=None, **sel):
+        df = self.df if columns is None else self.df[columns]
+        if all(v is None for v in sel.values()): return df
+        return df.take(self.positions(**sel))
+
+# ================= SKU 宏观聚合索引 =================
+# 每个数据集版本构建一次：行先按 (月份, 库龄段, SKU, 部门, 服务商, 仓库) 合并，
+# 再按 (月份, 库龄段, SKU) 预先汇总数量/体积/费用、库龄加权和与仓库/部门/服务商去重数。
+# 不筛选部门/服务商/仓库时直接切出预汇总行；有筛选时只在该 (月份, 库龄段) 块内向量化重算
+MACRO_DIMS = ['Date', 'Age_Range', 'SKU', 'Dept', 'Provider', 'Warehouse']
+MACRO_SUMS = ['Qty', 'Vol', 'Fee', 'AgeSum', 'AgeN']
+
+def _segment_reduce(fine, starts, n_cats):
+    # fine: 按 SKU 连续排列的明细数组；starts: 每个 SKU 段的起点
+    out = {'SKU': fine['SKU'][starts]}
+    for col in MACRO_SUMS: out[col] = np.add.reduceat(fine[col], starts) if len(starts) else fine[col][:0]
+    seg = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, len(fine['SKU']))))
+    for dim in ['Dept', 'Provider', 'Warehouse']:
+        # 段内去重数 = 不同 (段, 取值) 对的个数；缺失值 (-1) 不计，与 nunique 一致
+        codes = fine[dim]
+        valid = codes >= 0
+        pairs = np.unique(seg[valid] * (n_cats[dim] + 1) + codes[valid])
+        out[dim] = np.bincount(pairs // (n_cats[dim] + 1), minlength=len(starts))
+    return out
+
+def _sku_starts(sku):
+    return np.flatnonzero(np.r_[True, sku[1:] != sku[:-1]]) if len(sku) else np.empty(0, dtype=np.intp)
+
+class SkuMacroIndex:
+    def __init__(self, df):
+        self._cats = {dim: df[dim].cat.categories for dim in MACRO_DIMS}
+        self._n = {dim: len(cats) for dim, cats in self._cats.items()}
+        codes = pd.DataFrame({dim: df[dim].cat.codes.to_numpy() for dim in MACRO_DIMS})
+        for col in ['Qty', 'Vol', 'Fee']: codes[col] = df[col].to_numpy(dtype='float64')
+        # 库龄按非空行求均值，与 groupby mean 一致
+        age = df['Age'].to_numpy(dtype='float64')
+        codes['AgeSum'] = np.nan_to_num(age)
+        codes['AgeN'] = (~np.isnan(age)).astype(np.int64)
+        codes = codes[(codes[['Date', 'Age_Range', 'SKU']].to_numpy() >= 0).all(axis=1)]
+        grouped = codes.groupby(MACRO_DIMS, sort=True).agg(
+            Qty=('Qty', 'sum'), Vol=('Vol', 'sum'), Fee=('Fee', 'sum'), AgeSum=('AgeSum', 'sum'), AgeN=('AgeN', 'sum'),
+        ).reset_index()
+        self._fine = {col: grouped[col].to_numpy() for col in MACRO_DIMS + MACRO_SUMS}
+        n_blocks = self._n['Date'] * self._n['Age_Range']
+        block = self._fine['Date'].astype(np.int64) * self._n['Age_Range'] + self._fine['Age_Range']
+        self._fine_bounds = np.searchsorted(block, np.arange(n_blocks + 1))
+        # 预汇总：SKU 段不跨块 (块键在排序里优先)，按 (块, SKU) 切段
+        starts = np.flatnonzero(np.r_[True, (block[1:] != block[:-1]) | (self._fine['SKU'][1:] != self._fine['SKU'][:-1])]) \
+            if len(block) else np.empty(0, dtype=np.intp)
+        self._coarse = _segment_reduce(self._fine, starts, self._n)
+        self._coarse_bounds = np.searchsorted(block[starts], np.arange(n_blocks + 1))
+        self._present = {}
+
+    @property
+    def nbytes(self):
+        arrays = [*self._fine.values(), *self._coarse.values(), self._fine_bounds, self._coarse_bounds]
+        return sum(a.nbytes for a in arrays)
+
+    def _code(self, dim, value):
+        idx = self._cats[dim].get_indexer([str(value)])[0]
+        return None if idx < 0 else idx
+
+    def _block_values(self, dim, b, lo, hi):
+        # 块内实际出现的取值，判断 "全选" 时不必逐行比较
+        key = (dim, b)
+        if key not in self._present: self._present[key] = np.unique(self._fine[dim][lo:hi])
+        return self._present[key]
+
+    def macro(self, Date, Age_Range, Dept=None, Provider=None, Warehouse=None, count_depts=False, count_provs=False):
+        d, a = self._code('Date', Date), self._code('Age_Range', Age_Range)
+        if d is None or a is None:
+            empty = {col: arr[:0] for col, arr in self._fine.items()}
+            return self._frame(_segment_reduce(empty, np.empty(0, dtype=np.intp), self._n), count_depts, count_provs)
+        b = d * self._n['Age_Range'] + a
+        lo, hi = self._fine_bounds[b], self._fine_bounds[b + 1]
+        mask = None
+        for dim, value in [('Dept', Dept), ('Provider', Provider), ('Warehouse', Warehouse)]:
+            if value is None: continue
+            values = list(value) if pd.api.types.is_list_like(value) else [value]
+            wanted = self._cats[dim].get_indexer(pd.Index(np.asarray(values, dtype=object)).astype(str))
+            wanted = wanted[wanted >= 0]
+            if np.isin(self._block_values(dim, b, lo, hi), wanted).all(): continue
+            m = np.isin(self._fine[dim][lo:hi], wanted)
+            mask = m if mask is None else mask & m
+        if mask is None:
+            c_lo, c_hi = self._coarse_bounds[b], self._coarse_bounds[b + 1]
+            agg = {col: arr[c_lo:c_hi] for col, arr in self._coarse.items()}
+        else:
+            fine = {col: arr[lo:hi][mask] for col, arr in self._fine.items()}
+            agg = _segment_reduce(fine, _sku_starts(fine['SKU']), self._n)
+        return self._frame(agg, count_depts, count_provs)
+
+    def _frame(self, agg, count_depts, count_provs):
+        # 与 analytics.sku_macro 的输出列一致
+        n = agg['AgeN']
+        out = pd.DataFrame({
+            'SKU': pd.Categorical.from_codes(agg['SKU'], categories=self._cats['SKU']),
+            'Qty': agg['Qty'], 'Vol': agg['Vol'], 'Fee': agg['Fee'],
+            'Age': np.where(n > 0, agg['AgeSum'] / np.maximum(n, 1), np.nan),
+            'Warehouse': agg['Warehouse'], 'Dept': agg['Dept'], 'Provider': agg['Provider'],
+        })
+        out['分布情况'] = distribution_labels(out['Warehouse'], out['Dept'], out['Provider'], count_depts, count_provs)
+        return out
@@ -0,0 +1,105 @@
+import json
+import os
+import time
+
+import pandas as pd
+
+from analytics import age_summary, build_cube, cpu_by_date, detect_drift, rollup, sku_macro, tracking_pivot  # noqa: F401
+from dataset import DatasetManager, FilterEngine  # noqa: F401
+from history_store import HAS_DUCKDB, HistoryStore  # noqa: F401
+from ingest import (  # noqa: F401
+    AGE_LABELS, COLUMN_MAPS, PARSER_VERSION, iter_load_files, load_inventory_file, parse_filename,
+)
+from sku_dict import SkuDictionary
+from snapshot_store import SnapshotStore
+
+# ================= 无界面引擎 =================
+# 解析与分析逻辑的统一入口，不依赖 Streamlit；看板和 etl.py 命令行共用
+SNAPSHOT_DIR = os.environ.get('LTL_SNAPSHOT_DIR', '.snapshots')
+DEFAULT_DICT_PATH = 'sku_dict.csv'
+# 预计算产物放在快照目录的子目录里，快照库的 list() 只扫描根目录的 .json
+ARTIFACT_SUBDIR = 'etl'
+ARTIFACT_NAMES = ['cube', 'drift']
+INPUT_EXTS = ('.xlsx', '.xls', '.csv')
+# 磁盘查询模式 (多年历史)：分区目录与查询引擎内存上限
+HISTORY_DIR = os.environ.get('LTL_HISTORY_DIR', os.path.join(SNAPSHOT_DIR, 'history'))
+HISTORY_MEMORY = os.environ.get('LTL_HISTORY_MEMORY', '1GB')
+
+def open_store(root=SNAPSHOT_DIR):
+    return SnapshotStore(root, PARSER_VERSION)
+
+def open_history(root=HISTORY_DIR, memory_limit=HISTORY_MEMORY):
+    return HistoryStore(root, memory_limit)
+
+def load_data(file_content, file_name, store=None, key=None):
+    # 与看板的 load_data_cached 相同的解析结果 (快照命中时直接读 Parquet)；key 可传入已算好的快照指纹
+    return load_inventory_file(file_content, file_name, store, key)
+
+def load_sku_mapping(path=DEFAULT_DICT_PATH, cache_dir=SNAPSHOT_DIR):
+    if not path or not os.path.exists(path): return SkuDictionary.empty()
+    return SkuDictionary.load(path, cache_dir)
+
+def read_dir(path):
+    # 读取目录下所有库存导出文件：[(file_content, file_name), ...]，按文件名排序
+    files = []
+    for name in sorted(os.listdir(path)):
+        if name.startswith('~$') or not name.lower().endswith(INPUT_EXTS): continue
+        with open(os.path.join(path, name), 'rb') as f: files.append((f.read(), name))
+    return files
+
+def build_dataset(files, store=None, workers=None, serial=False):
+    # 返回 (DatasetManager, 指纹列表)；指纹与快照库一致，看板可按指纹直接复用
+    keys = [store.key(c, n) if store else f"{i}:{n}" for i, (c, n) in enumerate(files)]
+    loaded = {}
+    for i, df in iter_load_files(files, store, workers=workers, serial=serial, keys=keys if store else None):
+        loaded[keys[i]] = df
+    dataset = DatasetManager()
+    dataset.sync(keys, loaded)
+    return dataset, keys
+
+# ----------------------------------------------------
+# 预计算产物：manifest + 立方体 + 全量恶化清单
+# ----------------------------------------------------
+def artifact_dir(root=SNAPSHOT_DIR):
+    return os.path.join(root, ARTIFACT_SUBDIR)
+
+def write_artifacts(dataset, keys, files, root=SNAPSHOT_DIR):
+    out_dir = artifact_dir(root)
+    os.makedirs(out_dir, exist_ok=True)
+    full_df = dataset.frame()
+    dates = sorted(full_df['Date'].cat.categories.astype(str)) if full_df is not None else []
+    manifest = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'parser_version': PARSER_VERSION,
+        'rows': int(len(full_df)) if full_df is not None else 0, 'dates': dates,
+        'files': [{'key': k, 'file_name': n, 'source_format': dataset.formats.get(k),
+                   'rows': (dataset.load_stats.get(k) or {}).get('rows'),
+                   'error': (dataset.load_stats.get(k) or {}).get('error')}
+                  for k, (_, n) in zip(keys, files)],
+    }
+    if full_df is not None:
+        dataset.cube().to_parquet(os.path.join(out_dir, 'cube.parquet'), index=False)
+        drift = detect_drift(full_df, dates)
+        drift.to_parquet(os.path.join(out_dir, 'drift.parquet'), index=False)
+        manifest['drift_rows'] = int(len(drift))
+    # manifest 最后写：读到 manifest 即说明其余产物已完整
+    tmp_path = os.path.join(out_dir, f'manifest.json.{os.getpid()}.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f: json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, os.path.join(out_dir, 'manifest.json'))
+    return manifest
+
+def read_manifest(root=SNAPSHOT_DIR):
+    path = os.path.join(artifact_dir(root), 'manifest.json')
+    if not os.path.exists(path): return None
+    try:
+        with open(path, encoding='utf-8') as f: manifest = json.load(f)
+    except (OSError, ValueError): return None
+    # 解析器升级后旧产物作废
+    return manifest if manifest.get('parser_version') == PARSER_VERSION else None
+
+def read_artifact(name, root=SNAPSHOT_DIR):
+    path = os.path.join(artifact_dir(root), f'{name}.parquet')
+    return pd.read_parquet(path) if os.path.exists(path) else None
+
+def read_artifacts(root=SNAPSHOT_DIR):
+    # 看板载入预计算数据时直接使用：立方体 + 全部月份的恶化清单 (缺失的产物为 None)
+    return {name: read_artifact(name, root) for name in ARTIFACT_NAMES}
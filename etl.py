@@ -0,0 +1,43 @@
+import argparse
+import os
+import sys
+import time
+
+from engine import SNAPSHOT_DIR, build_dataset, load_sku_mapping, open_store, read_dir, write_artifacts
+
+# ================= 夜间批处理 =================
+# python etl.py <导出文件目录> [--out 快照目录]
+# 解析结果写入快照库 (看板上传同样文件时直接命中)，并生成 manifest / 立方体 / 恶化清单，
+# 看板勾选 "载入预计算数据" 即可不上传直接分析
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="批量解析库存导出文件并生成预计算产物")
+    ap.add_argument('input_dir', help="存放 部门_服务商_月份 导出文件的目录")
+    ap.add_argument('--out', default=SNAPSHOT_DIR, help="快照/产物目录，需与看板的 LTL_SNAPSHOT_DIR 一致")
+    ap.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="并行进程数，默认 CPU 核数")
+    ap.add_argument('--serial', action='store_true', help="串行解析 (调试用)")
+    ap.add_argument('--dict', dest='dict_path', default=None, help="同时预建 SKU 字典索引")
+    args = ap.parse_args(argv)
+
+    t0 = time.perf_counter()
+    store = open_store(args.out)
+    if not store.enabled:
+        print("⚠️ 未安装 pyarrow 或快照目录不可写，无法生成产物", file=sys.stderr)
+        return 1
+    files = read_dir(args.input_dir)
+    if not files:
+        print(f"⚠️ {args.input_dir} 下没有可解析的文件", file=sys.stderr)
+        return 1
+
+    dataset, keys = build_dataset(files, store, workers=args.workers, serial=args.serial)
+    manifest = write_artifacts(dataset, keys, files, args.out)
+    if args.dict_path: load_sku_mapping(args.dict_path, args.out)
+    store.prune(stale=True)
+
+    failed = [f for f in manifest['files'] if f['error']]
+    for f in failed: print(f"❌ {f['file_name']}: {f['error']}", file=sys.stderr)
+    print(f"✅ {len(files) - len(failed)}/{len(files)} 个文件 · {manifest['rows']:,} 行 · "
+          f"{len(manifest['dates'])} 个月份 · {time.perf_counter() - t0:.1f}s -> {os.path.abspath(args.out)}")
+    return 0 if not failed else 2
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,63 @@
+import io
+
+# ================= 分块导出 =================
+# 导出只在用户请求时生成；按块转换/编码，峰值内存只多出一个块，不再整表 to_csv 再 encode
+EXPORT_CHUNK_ROWS = 20000
+XLSX_MAX_ROWS = 1048575  # 单个工作表行数上限 (不含表头)
+
+def iter_chunks(df, transform=None, chunk_rows=EXPORT_CHUNK_ROWS):
+    # transform 对每个块做列补充/重命名 (如关联产品名称)，避免先构造完整的导出表
+    if df is None: return
+    if not len(df):
+        yield transform(df) if transform else df
+        return
+    for start in range(0, len(df), chunk_rows):
+        chunk = df.iloc[start:start + chunk_rows]
+        yield transform(chunk) if transform else chunk
+
+def iter_csv(df, transform=None, chunk_rows=EXPORT_CHUNK_ROWS, encoding='utf-8-sig'):
+    # 逐块产出 CSV 字节；BOM 只写在第一块 (Excel 据此识别 UTF-8)
+    body_encoding = 'utf-8' if encoding == 'utf-8-sig' else encoding
+    for i, chunk in enumerate(iter_chunks(df, transform, chunk_rows)):
+        yield chunk.to_csv(index=False, header=(i == 0)).encode(encoding if i == 0 else body_encoding)
+
+def _excel_rows(chunk):
+    # openpyxl 不认识 NaN/分类值：缺失值写成空单元格，其余转为 Python 标量
+    values = chunk.astype(object).where(chunk.notna(), None)
+    return values.itertuples(index=False, name=None)
+
+def write_xlsx(sheets, fileobj, chunk_rows=EXPORT_CHUNK_ROWS):
+    # sheets: [(工作表名, DataFrame, transform 或 None), ...]；write_only 模式逐行落盘，不在内存里保留单元格对象
+    from openpyxl import Workbook
+    wb = Workbook(write_only=True)
+    for title, df, transform in sheets:
+        if df is None: continue
+        ws = wb.create_sheet(title=str(title)[:31])
+        written, header = 0, False
+        for chunk in iter_chunks(df, transform, chunk_rows):
+            if not header:
+                ws.append([str(c) for c in chunk.columns])
+                header = True
+            chunk = chunk.iloc[:max(XLSX_MAX_ROWS - written, 0)]
+            for row in _excel_rows(chunk): ws.append(row)
+            written += len(chunk)
+    if not wb.worksheets: wb.create_sheet(title='Sheet1')
+    wb.save(fileobj)
+    return fileobj
+
+def export_file(fmt, sheets, chunk_rows=EXPORT_CHUNK_ROWS):
+    # fmt: 'csv' 只导出第一个工作表；'xlsx' 每个 (名称, 表) 一个工作表
+    # 块直接写进同一个缓冲区，不保留块列表也不再拼接出第二份；返回已回到开头的文件对象
+    buf = io.BytesIO()
+    if fmt == 'csv':
+        title, df, transform = sheets[0]
+        for data in iter_csv(df, transform, chunk_rows): buf.write(data)
+    else:
+        write_xlsx(sheets, buf, chunk_rows)
+    buf.seek(0)
+    return buf
+
+EXPORT_MIME = {
+    'csv': 'text/csv',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
@@ -0,0 +1,275 @@
+import json
+import os
+import threading
+import time
+from urllib.parse import quote
+
+import numpy as np
+import pandas as pd
+
+from analytics import CUBE_DIMS, DRIFT_COLS, DRIFT_KEYS, with_distribution
+from dataset import AGE_DTYPE, compact_frame
+from ingest import AGE_LABELS
+from snapshot_store import HAS_ARROW, SNAPSHOT_COLS
+
+try:
+    import duckdb
+    HAS_DUCKDB = True
+except ImportError:
+    HAS_DUCKDB = False
+
+# 库龄段 -> 序号，恶化比较在查询引擎里完成
+AGE_IDX_SQL = "CASE Age_Range " + " ".join(f"WHEN '{label}' THEN {i}" for i, label in enumerate(AGE_LABELS)) + " END"
+PARTITION_DIMS = ['Date', 'Provider', 'Dept']
+
+
+# ----------------------------------------------------
+# 磁盘历史库：标准化分区按 月份/服务商/部门 分目录存 Parquet，
+# 筛选、分组和恶化比较都下推给 DuckDB，只物化结果集；接口与 DatasetManager/FilterEngine 一致
+# ----------------------------------------------------
+class HistoryStore:
+    def __init__(self, root, memory_limit='1GB', threads=None):
+        self.root = root
+        self.enabled = HAS_DUCKDB and HAS_ARROW
+        self.version = 0
+        self.formats = {}
+        self.load_stats = {}
+        self._index = {}
+        self._index_mtime = None
+        self._cube = None
+        self._cube_version = None
+        self._lock = threading.Lock()
+        self._con = None
+        if not self.enabled: return
+        try: os.makedirs(self._data_dir, exist_ok=True)
+        except OSError:
+            self.enabled = False
+            return
+        # 内存上限 + 溢出目录：聚合/连接超出预算时落盘而不是撑爆进程
+        self._con = duckdb.connect()
+        self._con.execute(f"SET memory_limit = '{memory_limit}'")
+        self._con.execute(f"SET temp_directory = '{self._sql_path(os.path.join(root, 'tmp'))}'")
+        if threads: self._con.execute(f"SET threads = {int(threads)}")
+        self.refresh()
+
+    @property
+    def _data_dir(self):
+        return os.path.join(self.root, 'data')
+
+    @property
+    def _index_path(self):
+        return os.path.join(self.root, 'index.json')
+
+    @staticmethod
+    def _sql_path(path):
+        return path.replace("'", "''")
+
+    # ---------- 分区管理 ----------
+    def refresh(self, force=False):
+        # 其他会话/进程可能写入了新分区：index.json 变化时重新读取；写入前 force 读取，不依赖 mtime 精度
+        try: mtime = os.path.getmtime(self._index_path)
+        except OSError: return
+        if mtime == self._index_mtime and not force: return
+        try:
+            with open(self._index_path, encoding='utf-8') as f: state = json.load(f)
+        except (OSError, ValueError): return
+        self._index = state.get('files', {})
+        self.version = state.get('version', 0)
+        self._index_mtime = mtime
+        for k, meta in self._index.items():
+            self.formats[k] = meta.get('source_format')
+
+    def _save_index(self, index, version):
+        # 读者不加锁遍历 self._index：写入方先改副本，落盘后一次赋值换上
+        tmp_path = self._index_path + f'.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': version, 'files': index}, f, ensure_ascii=False)
+        os.replace(tmp_path, self._index_path)
+        self._index_mtime = os.path.getmtime(self._index_path)
+        self._index, self.version = index, version
+
+    def _partition_path(self, key, df):
+        parts = [f"{dim}={quote(str(df[dim].iloc[0]), safe='')}" for dim in PARTITION_DIMS]
+        return os.path.join(self._data_dir, *parts, f"{key}.parquet")
+
+    def missing(self, keys):
+        self.refresh()
+        return [k for k in dict.fromkeys(keys) if k not in self._index]
+
+    def sync(self, keys, new_frames):
+        # 只追加：历史库保留所有写入过的分区，未出现在 keys 里的文件不删除 (用 remove 显式删除)
+        if not self.enabled: return False
+        added = [k for k in dict.fromkeys(keys) if k not in self._index and k in new_frames]
+        if not added: return False
+        with self._lock:
+            # 写 index.json 前重新读取，保留其他会话/进程刚写入的分区
+            self.refresh(force=True)
+            added = [k for k in added if k not in self._index]
+            if not added: return False
+            index, load_stats = dict(self._index), dict(self.load_stats)
+            for k in added:
+                df = new_frames[k]
+                self.formats[k] = df.attrs.get('source_format')
+                load_stats[k] = df.attrs.get('load_stats')
+                meta = {'rows': int(len(df)), 'source_format': self.formats[k], 'created': time.time(), 'path': None}
+                if not df.empty:
+                    path = self._partition_path(k, df)
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    tmp_path = path + f'.{os.getpid()}.tmp'
+                    frame = df[SNAPSHOT_COLS].copy()
+                    for col in SNAPSHOT_COLS:
+                        # 分类列写成普通字符串，各分区的 schema 一致
+                        if isinstance(frame[col].dtype, pd.CategoricalDtype): frame[col] = frame[col].astype(object)
+                    frame.to_parquet(tmp_path, index=False)
+                    os.replace(tmp_path, path)
+                    meta['path'] = os.path.relpath(path, self.root)
+                    meta.update({dim: str(df[dim].iloc[0]) for dim in PARTITION_DIMS})
+                index[k] = meta
+            self._save_index(index, self.version + 1)
+            self.load_stats = load_stats
+        return True
+
+    def remove(self, keys):
+        with self._lock:
+            self.refresh(force=True)
+            removed = 0
+            index = dict(self._index)
+            for k in keys:
+                meta = index.pop(k, None)
+                if meta is None: continue
+                removed += 1
+                if meta.get('path'):
+                    try: os.remove(os.path.join(self.root, meta['path']))
+                    except FileNotFoundError: pass
+            if removed: self._save_index(index, self.version + 1)
+        return removed
+
+    def list(self):
+        cols = ['key', 'Date', 'Provider', 'Dept', 'rows', 'source_format', 'created']
+        if not self._index: return pd.DataFrame(columns=cols)
+        return pd.DataFrame([{'key': k, **m} for k, m in self._index.items()]).reindex(columns=cols)
+
+    @property
+    def identity(self):
+        return f"history:{os.path.abspath(self.root)}@{self.version}"
+
+    @property
+    def file_count(self):
+        return sum(1 for m in self._index.values() if m.get('path'))
+
+    @property
+    def row_count(self):
+        return sum(m.get('rows', 0) for m in self._index.values() if m.get('path'))
+
+    # ---------- 查询 ----------
+    def _source(self):
+        # 分区列本来就写在每个文件里：关闭目录名推断，否则 202401 会被推断成整数、与字符串筛选无法比较
+        glob = os.path.join(self._data_dir, '**', '*.parquet')
+        return f"read_parquet('{self._sql_path(glob)}', hive_partitioning = false)"
+
+    def _where(self, sel, params):
+        # 同一分区文件内 月份/服务商/部门 为常量，Parquet 统计信息即可跳过无关文件
+        clauses = []
+        for dim, value in sel.items():
+            if value is None: continue
+            name = f"p{len(params)}"
+            if pd.api.types.is_list_like(value):
+                params[name] = [str(v) for v in value]
+                clauses.append(f'"{dim}" IN (SELECT UNNEST(${name}::VARCHAR[]))')
+            else:
+                params[name] = str(value)
+                clauses.append(f'"{dim}" = ${name}')
+        return " AND ".join(clauses) or "TRUE"
+
+    def query(self, sql, params=None):
+        # 每次查询用独立游标，Streamlit 多线程会话可以并发查询
+        return self._con.cursor().execute(sql, params or {}).df()
+
+    def options(self, dim, **sel):
+        if not self.file_count: return []
+        params = {}
+        df = self.query(f'SELECT DISTINCT "{dim}" AS v FROM {self._source()} '
+                        f'WHERE {self._where(sel, params)} AND "{dim}" IS NOT NULL ORDER BY v', params)
+        return df['v'].astype(str).tolist()
+
+    def options_by(self, dim, by, values):
+        # 一次分组查询取回所有取值的选项，不按取值逐个扫描分区
+        values = [str(v) for v in values]
+        out = {v: [] for v in values}
+        if not self.file_count or not values: return out
+        params = {}
+        df = self.query(f'SELECT DISTINCT "{by}" AS k, "{dim}" AS v FROM {self._source()} '
+                        f'WHERE {self._where({by: values}, params)} AND "{dim}" IS NOT NULL ORDER BY k, v', params)
+        for k, v in zip(df['k'].astype(str), df['v'].astype(str)): out[k].append(v)
+        return out
+
+    def frame(self, columns=None, **sel):
+        # 只物化筛选结果，并转成与内存模式相同的紧凑表示
+        cols = columns or SNAPSHOT_COLS
+        if not self.file_count: return compact_frame(pd.DataFrame(columns=cols))
+        params = {}
+        cols_sql = ', '.join(f'"{c}"' for c in cols)
+        df = self.query(f"SELECT {cols_sql} FROM {self._source()} WHERE {self._where(sel, params)}", params)
+        return compact_frame(df)
+
+    def cube(self):
+        # 立方体只有维度组合数那么多行，与历史长度无关；按版本缓存
+        if self._cube is not None and self._cube_version == self.version: return self._cube
+        if not self.file_count: return None
+        dims = ', '.join(f'"{d}"' for d in CUBE_DIMS)
+        cube = self.query(f"SELECT {dims}, SUM(Qty) AS Qty, SUM(Fee) AS Fee, SUM(Vol) AS Vol, COUNT(*) AS Rows "
+                          f"FROM {self._source()} GROUP BY {dims}")
+        cube = compact_frame(cube)
+        for col in ['Qty', 'Fee', 'Vol']: cube[col] = cube[col].astype('float64')
+        self._cube, self._cube_version = cube, self.version
+        return cube
+
+    def sku_macro(self, count_depts=False, count_provs=False, **sel):
+        params = {}
+        base_df = self.query(f"""
+            SELECT SKU, SUM(Qty) AS Qty, SUM(Vol) AS Vol, SUM(Fee) AS Fee, AVG(Age) AS Age,
+                   COUNT(DISTINCT Warehouse) AS Warehouse, COUNT(DISTINCT Dept) AS Dept, COUNT(DISTINCT Provider) AS Provider
+            FROM {self._source()} WHERE {self._where(sel, params)} AND SKU IS NOT NULL GROUP BY SKU
+        """, params) if self.file_count else pd.DataFrame(columns=['SKU', 'Qty', 'Vol', 'Fee', 'Age', 'Warehouse', 'Dept', 'Provider'])
+        return with_distribution(base_df, count_depts, count_provs)
+
+    def drift(self, dates, **sel):
+        # 与 analytics.detect_drift 同口径：键×月份取最差库龄段，比较所有相邻月份；连接与连续段统计都在 SQL 里完成
+        dates = sorted(str(d) for d in dates)
+        if len(dates) < 2 or not self.file_count: return pd.DataFrame(columns=DRIFT_COLS)
+        sel = {**sel, 'Date': dates}
+        params = {'dates': dates}
+        keys = ', '.join(DRIFT_KEYS)
+        on = ' AND '.join(f"c.{k} = p.{k}" for k in DRIFT_KEYS)
+        df = self.query(f"""
+            WITH cell AS (
+                SELECT {keys}, list_position($dates::VARCHAR[], Date) - 1 AS m, MAX({AGE_IDX_SQL}) AS age, SUM(Fee) AS fee
+                FROM {self._source()}
+                WHERE {self._where(sel, params)} AND SKU IS NOT NULL AND Warehouse IS NOT NULL
+                GROUP BY ALL
+            ), ev AS (
+                SELECT {', '.join(f'c.{k}' for k in DRIFT_KEYS)}, c.m, p.age AS old, c.age AS new, c.fee
+                FROM cell c JOIN cell p ON {on} AND p.m = c.m - 1
+                WHERE c.age > p.age
+            ), stats AS (
+                SELECT {keys}, COUNT(*) AS n, MAX(m) AS last_m, MAX(run) AS best FROM (
+                    SELECT {keys}, m, COUNT(*) OVER (PARTITION BY {keys}, grp) AS run FROM (
+                        SELECT {keys}, m, m - ROW_NUMBER() OVER (PARTITION BY {keys} ORDER BY m) AS grp FROM ev
+                    )
+                ) GROUP BY ALL
+            )
+            SELECT ev.*, stats.n, stats.best FROM ev JOIN stats USING ({keys}) WHERE ev.m = stats.last_m
+        """, params)
+        if df.empty: return pd.DataFrame(columns=DRIFT_COLS)
+        m = df['m'].to_numpy().astype(int)
+        old, new = df['old'].to_numpy().astype(int), df['new'].to_numpy().astype(int)
+        pairs = np.array([f"{a}→{b}" for a, b in zip(dates[:-1], dates[1:])])
+        result = df[DRIFT_KEYS].copy()
+        result['月份'] = pairs[m - 1]
+        result['Age_Range_old'] = pd.Categorical.from_codes(old, dtype=AGE_DTYPE)
+        result['Age_Range_new'] = pd.Categorical.from_codes(new, dtype=AGE_DTYPE)
+        result['跳档'] = new - old
+        result['连续恶化'] = df['best'].to_numpy().astype(np.int32)
+        result['恶化次数'] = df['n'].to_numpy().astype(int)
+        result['Fee'] = df['fee'].to_numpy()
+        return result[DRIFT_COLS].reset_index(drop=True)
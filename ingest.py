@@ -0,0 +1,371 @@
+import csv
+import io
+import multiprocessing
+import os
+import time
+import zipfile
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from snapshot_store import SNAPSHOT_COLS
+
+# ================= 1. 配置与映射 =================
+COLUMN_MAPS = {
+    'WP': { 
+        'SKU': 'SKU', 'Warehouse': '仓库/Warehouse', 
+        'Qty': '数量/Quantity', 'Fee': '金额/Amount', 
+        'Age': '库龄/Library of Age', 'Vol': '体积(m³)',
+        'Full_Name': 'WesternPost'
+    },
+    'LG': { 
+        'SKU': '乐仓货品编码', 'Warehouse': '仓库', 
+        'Qty': '数量', 'Fee': '计算金额', 
+        'Age': '库龄', 'Vol': '总体积',
+        'Full_Name': 'Lecangs'
+    },
+    'AI': { 
+        'SKU': 'SKU', 'Warehouse': '仓库', 
+        'Qty': '库存', 'Fee': '费用', 
+        'Age': '在库天数', 'Vol': '立方数',
+        'Full_Name': 'AI'
+    },
+    'WL': { 
+        'SKU': '商品SKU', 'Warehouse': '实际发货仓库', 
+        'Qty': '库存总数_QTY', 'Fee': '计费总价', 
+        'Age': '库存库龄_CD', 'Vol': '计费总体积_立方米',
+        'Full_Name': 'WWL'
+    }
+}
+
+AGE_BINS = [-1, 30, 60, 90, 120, 180, 360, 99999]
+AGE_LABELS = ['0-30天', '31-60天', '61-90天', '91-120天', '121-180天', '181-360天', '360天+']
+
+# 解析逻辑变化时递增，旧快照随之失效
+PARSER_VERSION = 2
+
+# ================= 2. 核心处理逻辑 =================
+
+def parse_filename(filename):
+    try:
+        name_body = filename.rsplit('.', 1)[0]
+        parts = name_body.split('_')
+        if len(parts) >= 3:
+            dept = parts[0]
+            raw_code = parts[1].upper()
+            provider_code = None
+            for key in COLUMN_MAPS.keys():
+                if key in raw_code:
+                    provider_code = key
+                    break
+            date_str = parts[2]
+            return dept, provider_code, date_str
+        return None, None, None
+    except Exception:
+        return None, None, None
+
+# ----------------------------------------------------
+# 两段式读取：先扫描前 20 行定位表头，再只取 6 个映射列
+# ----------------------------------------------------
+HEADER_SCAN_ROWS = 20
+CSV_SNIFF_BYTES = 256 * 1024
+TEXT_COLS = ['SKU', 'Warehouse']
+NUM_COLS = ['Qty', 'Fee', 'Age', 'Vol']
+REQUIRED_COLS = TEXT_COLS + NUM_COLS
+
+def clean_header(value):
+    return str(value).strip().replace('\ufeff', '')
+
+def locate_header(rows, mapping):
+    # 返回 (表头行号, {标准字段: 列位置})
+    expected_cols = set(mapping.values())
+    expected_cols.discard(mapping.get('Full_Name'))
+    header_idx = 0
+    for i, row in enumerate(rows):
+        if sum(1 for x in row if clean_header(x) in expected_cols) >= 2:
+            header_idx = i
+            break
+    positions = {}
+    if rows:
+        header = [clean_header(x) for x in rows[header_idx]]
+        for col in REQUIRED_COLS:
+            if mapping[col] in header: positions[col] = header.index(mapping[col])
+    return header_idx, positions
+
+def _is_blank_xlsx_row(row):
+    # 与 pandas.read_excel 一致：去掉行尾空单元格后为空即跳过
+    cells = list(row)
+    while cells and (cells[-1] is None or cells[-1] == ''): cells.pop()
+    return not cells or (len(cells) == 1 and isinstance(cells[0], str) and not cells[0].strip())
+
+_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+_REL_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+_ROW, _CELL, _VALUE, _TEXT, _INLINE = f'{_NS}row', f'{_NS}c', f'{_NS}v', f'{_NS}t', f'{_NS}is'
+
+def _first_sheet_path(zf):
+    # 与 pandas 的 sheet_name=0 一致：workbook.xml 中的第一个工作表
+    try:
+        sheet = ET.fromstring(zf.read('xl/workbook.xml')).find(f'{_NS}sheets/{_NS}sheet')
+        rid = sheet.get(f'{_REL_NS}id')
+        for rel in ET.fromstring(zf.read('xl/_rels/workbook.xml.rels')):
+            if rel.get('Id') == rid:
+                target = rel.get('Target')
+                return target.lstrip('/') if target.startswith('/') else 'xl/' + target
+    except Exception: pass
+    return 'xl/worksheets/sheet1.xml'
+
+def _shared_strings(zf):
+    if 'xl/sharedStrings.xml' not in zf.namelist(): return []
+    strings = []
+    with zf.open('xl/sharedStrings.xml') as f:
+        for _, el in ET.iterparse(f):
+            if el.tag != f'{_NS}si': continue
+            # 富文本按 run 拼接，忽略注音 (rPh)
+            strings.append(''.join(t.text or '' for t in el.iterfind(_TEXT))
+                           + ''.join(t.text or '' for t in el.iterfind(f'{_NS}r/{_TEXT}')))
+            el.clear()
+    return strings
+
+def _cell_value(c, sst):
+    t = c.get('t', 'n')
+    if t == 'inlineStr':
+        node = c.find(_INLINE)
+        value = ''.join(x.text or '' for x in node.iter(_TEXT)) if node is not None else None
+    else:
+        v = c.find(_VALUE)
+        if v is None or v.text is None: return None
+        value = v.text
+        if t == 's': value = sst[int(value)]
+        elif t == 'n':
+            # 与 pandas 一致：整数值的数字还原为 int
+            value = float(value)
+            if value.is_integer(): value = int(value)
+        elif t == 'b': return value == '1'
+        elif t == 'e': return None
+    return None if value == '' else value
+
+def _col_index(ref, cache):
+    letters = ref.rstrip('0123456789')
+    idx = cache.get(letters)
+    if idx is None:
+        idx = 0
+        for ch in letters: idx = idx * 26 + ord(ch) - 64
+        idx = cache[letters] = idx - 1
+    return idx
+
+def read_xlsx_projected(file_content, mapping):
+    # 直接流式解析 sheet XML：前 20 行取全部单元格定位表头，之后只转换映射列的单元格
+    with zipfile.ZipFile(io.BytesIO(file_content)) as zf:
+        sst = _shared_strings(zf)
+        head, records, wanted, cache = [], [], None, {}
+        with zf.open(_first_sheet_path(zf)) as f:
+            for _, el in ET.iterparse(f):
+                if el.tag != _ROW: continue
+                if wanted is None:
+                    cells, col = {}, -1
+                    for c in el:
+                        ref = c.get('r')
+                        col = _col_index(ref, cache) if ref else col + 1
+                        cells[col] = _cell_value(c, sst)
+                    row = [cells.get(i) for i in range(max(cells) + 1)] if cells else []
+                    if not _is_blank_xlsx_row(row): head.append(row)
+                    if len(head) == HEADER_SCAN_ROWS:
+                        header_idx, positions = locate_header(head, mapping)
+                        wanted = {p: j for j, p in enumerate(positions.values())}
+                        records.extend(tuple(r[p] if p < len(r) else None for p in positions.values()) for r in head[header_idx + 1:])
+                else:
+                    values, col, filled = [None] * len(wanted), -1, False
+                    for c in el:
+                        ref = c.get('r')
+                        col = _col_index(ref, cache) if ref else col + 1
+                        if len(c): filled = True
+                        j = wanted.get(col)
+                        if j is not None: values[j] = _cell_value(c, sst)
+                    if filled: records.append(tuple(values))
+                el.clear()
+    if wanted is None:
+        header_idx, positions = locate_header(head, mapping)
+        records = [tuple(r[p] if p < len(r) else None for p in positions.values()) for r in head[header_idx + 1:]]
+    cols = list(positions)
+    if not cols: return pd.DataFrame(index=range(len(records)))
+    return pd.DataFrame.from_records(records, columns=cols)
+
+def read_csv_projected(file_content, mapping, encoding):
+    sample = file_content[:CSV_SNIFF_BYTES].decode(encoding, errors='replace')
+    reader = csv.reader(io.StringIO(sample))
+    head, ends = [], []
+    for row in reader:
+        if not row: continue
+        head.append(row)
+        ends.append(reader.line_num)
+        if len(head) >= HEADER_SCAN_ROWS: break
+    header_idx, positions = locate_header(head, mapping)
+    skip = ends[header_idx] if ends else 0
+    pos = sorted(positions.values())
+    try:
+        df = pd.read_csv(
+            io.BytesIO(file_content), encoding=encoding, header=None, skiprows=skip,
+            usecols=pos or None, dtype={positions[c]: str for c in TEXT_COLS if c in positions},
+        )
+    except pd.errors.EmptyDataError:
+        df = pd.DataFrame(columns=pos)
+    df = df.rename(columns={p: c for c, p in positions.items()})
+    if not positions: df = pd.DataFrame(index=range(len(df)))
+    return df
+
+def read_xls_projected(file_content, mapping):
+    # 旧版 .xls 交给 pandas (需 xlrd)，读入后按同样规则投影
+    raw = pd.read_excel(io.BytesIO(file_content), header=None, dtype=object)
+    header_idx, positions = locate_header(raw.head(HEADER_SCAN_ROWS).values.tolist(), mapping)
+    df = raw.iloc[header_idx + 1:, list(positions.values())]
+    df.columns = list(positions)
+    return df.reset_index(drop=True)
+
+# ----------------------------------------------------
+# 格式嗅探：按魔数 / BOM / 编码探测直接选择读取器
+# ----------------------------------------------------
+ENCODING_PROBE_BYTES = 1024 * 1024
+
+def sniff_format(file_content):
+    # 返回 (格式, 编码)；格式为 xlsx / xls / csv，无法识别时编码为 None
+    head = file_content[:8]
+    if head.startswith(b'PK\x03\x04'): return 'xlsx', None
+    if head.startswith(b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'): return 'xls', None
+    if head.startswith(b'\xef\xbb\xbf'): return 'csv', 'utf-8-sig'
+    if head.startswith(b'\xff\xfe') or head.startswith(b'\xfe\xff'): return 'csv', 'utf-16'
+    sample = file_content[:ENCODING_PROBE_BYTES]
+    for enc in ['utf-8', 'gb18030']:
+        try:
+            sample.decode(enc)
+            return 'csv', enc
+        except UnicodeDecodeError as e:
+            # 采样截断在多字节字符中间不算失败
+            if len(file_content) > len(sample) and e.start >= len(sample) - 4: return 'csv', enc
+    return 'csv', None
+
+def describe_format(fmt, encoding):
+    return f"{fmt}:{encoding}" if encoding else fmt
+
+def format_mismatch(file_name, source_format):
+    # 扩展名与实际内容不一致时返回提示文字
+    ext = file_name.rsplit('.', 1)[-1].lower() if '.' in file_name else ''
+    actual = source_format.split(':', 1)[0]
+    if ext and ext != actual: return f"{file_name}: 扩展名 .{ext}，实际为 {source_format}"
+    return None
+
+def as_text(series):
+    # 统一为字符串，保留缺失值 (混合类型列无法写入 Parquet)
+    return series.where(series.isna(), series.astype(str))
+
+def parse_inventory_file(file_content, file_name):
+    try:
+        dept, provider_code, date_str = parse_filename(file_name)
+        
+        if not dept:
+            dept = "默认部门"
+            for code in COLUMN_MAPS.keys():
+                if code in file_name.upper():
+                    provider_code = code
+                    break
+            date_str = "最新"
+
+        if not provider_code: return failed_frame("文件名中未识别到服务商代码")
+
+        mapping = COLUMN_MAPS[provider_code]
+        fmt, encoding = sniff_format(file_content)
+        if fmt == 'xlsx': df = read_xlsx_projected(file_content, mapping)
+        elif fmt == 'xls': df = read_xls_projected(file_content, mapping)
+        elif encoding: df = read_csv_projected(file_content, mapping, encoding)
+        else: return failed_frame("无法识别文件编码")
+        rows_raw = len(df)
+
+        if provider_code == 'WL':
+            if not df.empty: df = df.iloc[1:]
+
+        for col in REQUIRED_COLS:
+            if col not in df.columns: df[col] = 0 
+        
+        if provider_code == 'LG':
+            parts = df['SKU'].astype(str).str.partition('-')
+            df['SKU'] = parts[2].where(parts[1] != '', parts[0])
+
+        for col in NUM_COLS:
+            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0).astype('float64')
+            
+        cut_series = pd.cut(df['Age'], bins=AGE_BINS, labels=AGE_LABELS, right=True)
+        df['Age_Range'] = cut_series.astype(str)
+        df.loc[df['Age_Range'] == 'nan', 'Age_Range'] = '360天+'
+        df['Age_Range'] = df['Age_Range'].str.strip()
+
+        df['Dept'] = str(dept)
+        df['Provider'] = str(mapping['Full_Name'])
+        df['Date'] = str(date_str)
+
+        df = df[SNAPSHOT_COLS].reset_index(drop=True)
+        df['SKU'] = as_text(df['SKU'])
+        df['Warehouse'] = as_text(df['Warehouse'])
+        df.attrs['source_format'] = describe_format(fmt, encoding)
+        df.attrs['rows_raw'] = rows_raw
+        return df
+    except Exception as e: return failed_frame(f"{type(e).__name__}: {e}")
+
+def failed_frame(reason):
+    # 解析失败仍返回空表，失败原因留在 attrs 里供性能面板展示
+    df = pd.DataFrame()
+    df.attrs['parse_error'] = reason
+    return df
+
+def record_load(df, file_content, file_name, path, t0):
+    # 单个文件的读取路径/耗时/行数记在 attrs 里；子进程返回时随 DataFrame 一起回传
+    df.attrs['load_stats'] = {
+        'file': file_name, 'path': path, 'bytes': len(file_content), 'rows_raw': df.attrs.get('rows_raw'),
+        'rows': len(df), 'seconds': round(time.perf_counter() - t0, 4), 'error': df.attrs.get('parse_error'),
+    }
+    return df
+
+def load_inventory_file(file_content, file_name, store=None, key=None):
+    t0 = time.perf_counter()
+    if store and not key: key = store.key(file_content, file_name)
+    if key:
+        df = store.get(key)
+        if df is not None: return record_load(df, file_content, file_name, 'snapshot', t0)
+    df = record_load(parse_inventory_file(file_content, file_name), file_content, file_name, 'parsed', t0)
+    if key: store.put(key, df, file_name)
+    return df
+
+def _load_job(args):
+    return load_inventory_file(*args)
+
+# ----------------------------------------------------
+# 批量解析：进程池并行，按完成顺序逐个返回 (序号, DataFrame)
+# ----------------------------------------------------
+# 看板默认进程数：多个会话同时上传时每个会话各起一个进程池，不按 CPU 核数铺满
+DEFAULT_WORKERS = min(4, os.cpu_count() or 1)
+
+def iter_load_files(files, store=None, workers=None, serial=False, keys=None):
+    # files: [(file_content, file_name), ...]；keys 可传入已算好的快照指纹
+    workers = workers or DEFAULT_WORKERS
+    if keys is None: keys = [store.key(c, n) if store else None for c, n in files]
+    pending = []
+    for i in range(len(files)):
+        # 已有快照的文件直接在主进程读取，不必把字节传给子进程
+        t0 = time.perf_counter()
+        df = store.get(keys[i]) if store else None
+        if df is not None: yield i, record_load(df, files[i][0], files[i][1], 'snapshot', t0)
+        else: pending.append(i)
+
+    if serial or workers <= 1 or len(pending) <= 1:
+        for i in pending:
+            yield i, load_inventory_file(files[i][0], files[i][1], store, keys[i])
+        return
+
+    # spawn：Streamlit 服务端是多线程进程，fork 有死锁风险
+    ctx = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=min(workers, len(pending)), mp_context=ctx) as pool:
+        futures = {pool.submit(_load_job, (files[i][0], files[i][1], store, keys[i])): i for i in pending}
+        for fut in as_completed(futures):
+            i = futures[fut]
+            try: df = fut.result()
+            except Exception as e: df = record_load(failed_frame(f"{type(e).__name__}: {e}"), files[i][0], files[i][1], 'failed', time.perf_counter())
+            yield i, df
@@ -0,0 +1,125 @@
+import json
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import pandas as pd
+
+# ================= 热点阶段计时 =================
+# 默认关闭：关闭时 start()/stop() 只操作一个丢弃的记录，不计时也不追踪内存
+STAGE_COLS = ['stage', 'seconds', 'rows_in', 'rows_out', 'peak_mb', 'error']
+FILE_COLS = ['file', 'path', 'bytes', 'rows_raw', 'rows', 'seconds', 'error']
+
+# tracemalloc 是进程级的：多个会话同时剖析时共用一次追踪，按引用计数开启/停止。
+# 峰值只能全进程重置，所以只在没有其他阶段在计时时重置；与其他阶段重叠的阶段不报告峰值
+_TRACE_LOCK = threading.RLock()
+_trace_users = 0
+_trace_owned = False
+_open_stages = 0
+_overlaps = 0
+
+def _acquire_trace():
+    global _trace_users, _trace_owned
+    with _TRACE_LOCK:
+        if _trace_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _trace_owned = True
+        _trace_users += 1
+
+def _release_trace():
+    global _trace_users, _trace_owned
+    with _TRACE_LOCK:
+        _trace_users -= 1
+        # 只停止自己开启的追踪 (外部工具开启的保持不动)
+        if _trace_users == 0 and _trace_owned:
+            if tracemalloc.is_tracing(): tracemalloc.stop()
+            _trace_owned = False
+
+def _begin_peak():
+    global _open_stages, _overlaps
+    with _TRACE_LOCK:
+        if _open_stages == 0: tracemalloc.reset_peak()
+        else: _overlaps += 1
+        _open_stages += 1
+        # 开始时已有其他阶段在计时：记 -1，结束时必定不报告峰值
+        return (_overlaps if _open_stages == 1 else -1), tracemalloc.get_traced_memory()[0]
+
+def _end_peak(epoch, mem0):
+    global _open_stages
+    with _TRACE_LOCK:
+        _open_stages -= 1
+        if epoch != _overlaps: return None
+        return round((tracemalloc.get_traced_memory()[1] - mem0) / 2 ** 20, 2)
+
+class Profiler:
+    def __init__(self, enabled=False, trace_memory=True):
+        self.enabled = enabled
+        self.trace_memory = trace_memory and enabled
+        self.stages = []
+        self._open = []
+        self._tracing = self.trace_memory
+        if self._tracing: _acquire_trace()
+
+    def start(self, name, rows_in=None):
+        # 阶段不嵌套：峰值内存按阶段重置，开始新阶段时先结束仍未结束的阶段
+        rec = {'stage': name, 'seconds': None, 'rows_in': rows_in, 'rows_out': None, 'peak_mb': None, 'error': None}
+        if not self.enabled: return rec
+        for prev in list(self._open): self.stop(prev)
+        if self.trace_memory: rec['_epoch'], rec['_mem0'] = _begin_peak()
+        rec['_t0'] = time.perf_counter()
+        self._open.append(rec)
+        return rec
+
+    def stop(self, rec, rows_out=None, error=None):
+        # 按对象身份查找：记录是 dict，内容相同的两条记录不能混淆
+        idx = next((i for i, r in enumerate(self._open) if r is rec), None)
+        if idx is None: return rec
+        del self._open[idx]
+        rec['seconds'] = round(time.perf_counter() - rec.pop('_t0'), 4)
+        if self.trace_memory: rec['peak_mb'] = _end_peak(rec.pop('_epoch'), rec.pop('_mem0'))
+        if rows_out is not None: rec['rows_out'] = rows_out
+        if error is not None: rec['error'] = f"{type(error).__name__}: {error}" if isinstance(error, Exception) else str(error)
+        self.stages.append(rec)
+        return rec
+
+    def fail(self, error):
+        # 在外层 except 里调用：把尚未结束的阶段记为出错，异常本身照常由外层处理
+        for rec in list(self._open): self.stop(rec, error=error)
+
+    @contextmanager
+    def stage(self, name, rows_in=None):
+        # 用法：with profiler.stage('load.sync', n) as rec: ...; rec['rows_out'] = len(out)
+        rec = self.start(name, rows_in)
+        try:
+            yield rec
+        except Exception as e:
+            self.stop(rec, error=e)
+            raise
+        self.stop(rec)
+
+    def close(self):
+        for rec in list(self._open): self.stop(rec)
+        if self._tracing: _release_trace()
+        self._tracing = False
+
+    def __del__(self):
+        # 脚本被重跑打断、没走到 close() 时也要归还追踪引用
+        self.close()
+
+    def frame(self):
+        return pd.DataFrame(self.stages, columns=STAGE_COLS)
+
+    def report(self, file_stats=()):
+        # file_stats: ingest.record_load 写入的每文件统计
+        return {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'stages': self.stages,
+            'files': [s for s in file_stats if s],
+        }
+
+    def to_json(self, file_stats=()):
+        return json.dumps(self.report(file_stats), ensure_ascii=False, indent=2)
+
+def file_frame(file_stats):
+    return pd.DataFrame([s for s in file_stats if s], columns=FILE_COLS)
@@ -0,0 +1,135 @@
+import hashlib
+import io
+import os
+
+import numpy as np
+import pandas as pd
+
+from ingest import describe_format, sniff_format
+
+# 索引结构变化时递增，旧的持久化索引随之失效
+INDEX_VERSION = 1
+NAME_WIDTH = 15
+# 乐仓货品编码前缀 (如 "LC12-")：解析时 LG 行已去掉前缀，字典里若存了带前缀的编码，去掉后作为别名。
+# 只认这种前缀：普通 SKU 大多本身含 "-"，按任意 "-" 去前缀会把未知 SKU 错配到别的商品
+LG_PREFIX = r'^LC\d+-'
+
+def truncate_names(names):
+    # 名称折叠的向量化版本：超过 15 个字符截断并加省略号
+    s = pd.Series(names, dtype=object).astype(str)
+    return np.where(s.str.len() > NAME_WIDTH, s.str.slice(0, NAME_WIDTH) + '...', s).astype(object)
+
+def _strip_prefix(values):
+    # 带乐仓前缀的编码取第一个 "-" 之后的部分，其余为 None
+    s = pd.Series(np.asarray(values, dtype=object), dtype=object).astype(str)
+    after = s.str.split('-', n=1).str[1]
+    return pd.Index(after.where(s.str.contains(LG_PREFIX, regex=True), None), dtype=object)
+
+
+# ----------------------------------------------------
+# SKU 字典：编码 -> 整数 id，名称存数组；支持向量化关联和前缀/子串搜索
+# ----------------------------------------------------
+class SkuDictionary:
+    def __init__(self, codes, names, source_format=None):
+        self.codes = np.asarray(codes, dtype=object)
+        self.names = np.asarray(names, dtype=object)
+        self.short_names = truncate_names(self.names)
+        self.source_format = source_format
+        self.index = pd.Index(self.codes)
+        # 字典里带乐仓前缀的编码，去掉前缀后也能命中 (不覆盖已有编码)；查询侧不去前缀，未知 SKU 保持未命中
+        stripped = _strip_prefix(self.codes)
+        alias_ok = stripped.notna() & ~stripped.isin(self.index) & ~stripped.duplicated(keep=False)
+        self._alias_index = stripped[alias_ok]
+        self._alias_ids = np.flatnonzero(alias_ok)
+        self._lower_codes = pd.Series(self.codes, dtype=object).str.lower()
+        self._lower_names = pd.Series(self.names, dtype=object).str.lower()
+        self._prefix_order = np.argsort(self._lower_codes.to_numpy().astype(str), kind='stable')
+        self._sorted_codes = self._lower_codes.to_numpy().astype(str)[self._prefix_order]
+
+    def __len__(self):
+        return len(self.codes)
+
+    @classmethod
+    def empty(cls):
+        return cls([], [])
+
+    @classmethod
+    def from_content(cls, content):
+        fmt, encoding = sniff_format(content)
+        df = None
+        try:
+            if fmt in ('xlsx', 'xls'): df = pd.read_excel(io.BytesIO(content), dtype=str)
+            elif encoding: df = pd.read_csv(io.BytesIO(content), header=0, encoding=encoding, dtype=str)
+        except Exception: pass
+        source_format = describe_format(fmt, encoding)
+        if df is None or len(df.columns) < 2: return cls([], [], source_format)
+        codes = df.iloc[:, 0].astype(str).str.strip()
+        names = df.iloc[:, 1].astype(str).str.strip()
+        # 与 dict(zip(...)) 一致：重复编码以最后一次出现为准
+        keep = ~codes.duplicated(keep='last').to_numpy()
+        return cls(codes.to_numpy()[keep], names.to_numpy()[keep], source_format)
+
+    @classmethod
+    def load(cls, path, cache_dir=None):
+        # 按字典文件内容指纹持久化索引，重启后不必重新解析 Excel
+        with open(path, 'rb') as f: content = f.read()
+        cache_path = None
+        if cache_dir:
+            digest = hashlib.sha1(content).hexdigest()
+            cache_path = os.path.join(cache_dir, f"sku_dict-{digest}-v{INDEX_VERSION}.npz")
+            if os.path.exists(cache_path):
+                try:
+                    with np.load(cache_path, allow_pickle=False) as z:
+                        return cls(z['codes'].astype(object), z['names'].astype(object), str(z['source_format']))
+                except Exception: pass
+        sku_dict = cls.from_content(content)
+        if cache_path and len(sku_dict):
+            try:
+                os.makedirs(cache_dir, exist_ok=True)
+                sku_dict.save(cache_path)
+            except OSError: pass
+        return sku_dict
+
+    def save(self, path):
+        tmp_path = path + f'.{os.getpid()}.tmp.npz'
+        np.savez(tmp_path, codes=self.codes.astype(str), names=self.names.astype(str),
+                 source_format=np.array(self.source_format or ''))
+        os.replace(tmp_path, path)
+
+    def _ids_for(self, values):
+        values = pd.Index(values).astype(str).str.strip()
+        ids = self.index.get_indexer(values)
+        miss = np.flatnonzero(ids < 0)
+        if len(miss) and len(self._alias_index):
+            hit = self._alias_index.get_indexer(values[miss])
+            ids[miss[hit >= 0]] = self._alias_ids[hit[hit >= 0]]
+        return ids
+
+    def ids(self, skus):
+        # 返回每个 SKU 对应的字典 id，未命中为 -1；分类列只对类别做一次查找
+        s = skus if isinstance(skus, pd.Series) else pd.Series(skus)
+        if not len(self) or not len(s): return np.full(len(s), -1, dtype=np.intp)
+        if isinstance(s.dtype, pd.CategoricalDtype):
+            cat_ids = self._ids_for(s.cat.categories)
+            codes = s.cat.codes.to_numpy()
+            return np.where(codes >= 0, cat_ids[codes], -1)
+        return self._ids_for(s.to_numpy())
+
+    def lookup(self, skus, short=False, missing='-'):
+        ids = self.ids(skus)
+        names = self.short_names if short else self.names
+        if not len(names): return np.full(len(ids), missing, dtype=object)
+        return np.where(ids >= 0, names[np.maximum(ids, 0)], missing)
+
+    def search(self, query, limit=50):
+        # 编码前缀匹配优先，其次是编码/名称子串匹配
+        q = str(query).strip().lower()
+        if not q or not len(self): return pd.DataFrame(columns=['SKU', '产品名称'])
+        lo = np.searchsorted(self._sorted_codes, q, side='left')
+        hi = np.searchsorted(self._sorted_codes, q + '￿', side='left')
+        prefix = self._prefix_order[lo:min(hi, lo + limit)]
+        if len(prefix) < limit:
+            contains = np.flatnonzero((self._lower_codes.str.contains(q, regex=False)
+                                       | self._lower_names.str.contains(q, regex=False)).to_numpy())
+            prefix = np.concatenate([prefix, contains[~np.isin(contains, prefix)]])[:limit]
+        return pd.DataFrame({'SKU': self.codes[prefix], '产品名称': self.names[prefix]})
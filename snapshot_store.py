@@ -0,0 +1,96 @@
+import hashlib
+import json
+import os
+import time
+
+import pandas as pd
+
+try:
+    import pyarrow  # noqa: F401  (Parquet 读写依赖)
+    HAS_ARROW = True
+except ImportError:
+    HAS_ARROW = False
+
+# 快照只保存标准化后的字段，与原始表头无关
+SNAPSHOT_COLS = ['SKU', 'Warehouse', 'Qty', 'Fee', 'Age', 'Vol', 'Age_Range', 'Dept', 'Provider', 'Date']
+
+
+# ----------------------------------------------------
+# 本地列式快照库：内容指纹 + 解析器版本 -> Parquet
+# ----------------------------------------------------
+class SnapshotStore:
+    def __init__(self, root, parser_version):
+        self.root = root
+        self.parser_version = parser_version
+        self.enabled = HAS_ARROW
+        if self.enabled:
+            try: os.makedirs(root, exist_ok=True)
+            except OSError: self.enabled = False
+
+    def key(self, file_content, file_name):
+        # 文件名参与指纹：部门/服务商/月份来自文件名
+        h = hashlib.sha1(file_content)
+        h.update(file_name.encode('utf-8'))
+        return f"{h.hexdigest()}-v{self.parser_version}"
+
+    def _paths(self, key):
+        base = os.path.join(self.root, key)
+        return base + '.parquet', base + '.json'
+
+    def get(self, key):
+        if not self.enabled: return None
+        data_path, _ = self._paths(key)
+        if not os.path.exists(data_path): return None
+        try: return pd.read_parquet(data_path)
+        except Exception: return None
+
+    def put(self, key, df, file_name):
+        if not self.enabled or df.empty: return False
+        data_path, meta_path = self._paths(key)
+        meta = {
+            'key': key, 'file_name': file_name, 'parser_version': self.parser_version,
+            'Dept': str(df['Dept'].iloc[0]), 'Provider': str(df['Provider'].iloc[0]), 'Date': str(df['Date'].iloc[0]),
+            'rows': int(len(df)), 'created': time.time(), 'source_format': df.attrs.get('source_format'),
+        }
+        try:
+            # 先写临时文件再替换，避免并发会话读到半截文件
+            tmp_path = data_path + f'.{os.getpid()}.tmp'
+            df[SNAPSHOT_COLS].to_parquet(tmp_path, index=False)
+            os.replace(tmp_path, data_path)
+            meta['bytes'] = os.path.getsize(data_path)
+            with open(meta_path, 'w', encoding='utf-8') as f: json.dump(meta, f, ensure_ascii=False)
+            return True
+        except Exception:
+            return False
+
+    def list(self):
+        cols = ['key', 'file_name', 'Dept', 'Provider', 'Date', 'rows', 'bytes', 'created', 'parser_version', 'source_format']
+        if not self.enabled: return pd.DataFrame(columns=cols)
+        records = []
+        for name in os.listdir(self.root):
+            if not name.endswith('.json'): continue
+            try:
+                with open(os.path.join(self.root, name), encoding='utf-8') as f: records.append(json.load(f))
+            except Exception: continue
+        if not records: return pd.DataFrame(columns=cols)
+        listing = pd.DataFrame(records).reindex(columns=cols)
+        listing['stale'] = listing['parser_version'] != self.parser_version
+        return listing.sort_values(['Date', 'file_name'], ascending=[False, True]).reset_index(drop=True)
+
+    def evict(self, key):
+        removed = False
+        for path in self._paths(key):
+            try:
+                os.remove(path)
+                removed = True
+            except FileNotFoundError: pass
+        return removed
+
+    def prune(self, dates=None, stale=True):
+        # 按月份清理旧快照；stale=True 时顺带清理旧解析器版本的快照
+        listing = self.list()
+        if listing.empty: return 0
+        mask = pd.Series(False, index=listing.index)
+        if dates: mask |= listing['Date'].isin([str(d) for d in dates])
+        if stale: mask |= listing['stale']
+        return sum(self.evict(k) for k in listing.loc[mask, 'key'])
@@ -0,0 +1,104 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from ingest import COLUMN_MAPS, REQUIRED_COLS
+
+# ================= 合成服务商导出文件 =================
+# 真实导出文件保密，这里按 COLUMN_MAPS 生成表头/布局一致的假数据，供基准测试和复现问题使用
+DEFAULT_DEPTS = ['业务一部', '业务二部']
+WAREHOUSES = {
+    'WP': ['WP-LA01', 'WP-NJ02', 'WP-UK01'],
+    'LG': ['美西一仓', '美东二仓', '德国仓'],
+    'AI': ['AI-CA', 'AI-TX', 'AI-DE'],
+    'WL': ['USWC', 'USEA', 'UKGB', 'DEFR'],
+}
+# 与业务无关的干扰列，检验只读映射列的投影逻辑
+EXTRA_COLS = ['备注', '品名', '批次号']
+# WL 导出：表头前有标题/说明行，表头后还有一行英文副表头 (解析时会跳过)
+WL_PREAMBLE = [['万邑通库存报表'], ['导出时间: 2024-01-31 23:59:59'], []]
+
+def sku_pool(size, seed=0):
+    rng = np.random.default_rng(seed)
+    ids = rng.choice(np.arange(100000, 100000 + size * 4), size=size, replace=False)
+    return np.array([f"SKU{i}" for i in ids], dtype=object)
+
+def make_frame(provider, rows, month_index=0, pool=None, seed=0):
+    # 返回带服务商原始表头的 DataFrame；同一 pool 在后续月份库龄整体后移约 30 天，部分 SKU 会跨档恶化
+    rng = np.random.default_rng(seed * 1000 + month_index)
+    pool = sku_pool(max(rows // 2, 1), seed) if pool is None else pool
+    sku_idx = rng.integers(0, len(pool), rows)
+    whs = np.asarray(WAREHOUSES[provider], dtype=object)
+    base_age = (np.random.default_rng(seed).integers(0, 400, len(pool)))[sku_idx]
+    age = np.maximum(base_age + 30 * month_index + rng.integers(-10, 11, rows), 0)
+    qty = rng.integers(1, 500, rows)
+    unit_vol = np.random.default_rng(seed + 1).uniform(0.001, 0.2, len(pool))[sku_idx]
+    vol = np.round(qty * unit_vol, 4)
+    fee = np.round(vol * 0.45 * (1 + (age > 180) + 2 * (age > 360)), 2)
+    skus = pool[sku_idx]
+    if provider == 'LG': skus = np.array([f"LC{w % 90 + 10}-{s}" for w, s in zip(sku_idx, skus)], dtype=object)
+    std = {'SKU': skus, 'Warehouse': whs[rng.integers(0, len(whs), rows)], 'Qty': qty, 'Fee': fee, 'Age': age, 'Vol': vol}
+    mapping = COLUMN_MAPS[provider]
+    df = pd.DataFrame({mapping[c]: std[c] for c in REQUIRED_COLS})
+    for i, col in enumerate(EXTRA_COLS):
+        df.insert(min(2 * i + 1, len(df.columns)), col, f"{col}-{month_index}")
+    return df
+
+def _layout_rows(df, provider):
+    # 文件里的全部行 (含表头)；WL 加前置说明行和表头后的副表头
+    rows = [list(df.columns)]
+    if provider == 'WL': rows = WL_PREAMBLE + rows + [[f"col_{i}" for i in range(len(df.columns))]]
+    return rows
+
+def write_provider_file(df, provider, path, fmt='xlsx', encoding='utf-8-sig'):
+    lead = _layout_rows(df, provider)
+    if fmt == 'csv':
+        with open(path, 'w', encoding=encoding, newline='') as f:
+            pd.DataFrame(lead).to_csv(f, index=False, header=False)
+            df.to_csv(f, index=False, header=False)
+        return path
+    from openpyxl import Workbook
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet('Sheet1')
+    for row in lead: ws.append(row)
+    for row in df.itertuples(index=False, name=None): ws.append(row)
+    wb.save(path)
+    return path
+
+def generate(out_dir, rows=10000, months=3, depts=DEFAULT_DEPTS, providers=None, fmt='xlsx',
+             encoding='utf-8-sig', start='2024-01', seed=0):
+    # 生成 部门 × 服务商 × 月份 个文件，文件名遵循 部门_服务商_月份 规范；rows 为每个文件的行数
+    providers = list(providers or COLUMN_MAPS)
+    dates = pd.period_range(start, periods=months, freq='M').astype(str)
+    os.makedirs(out_dir, exist_ok=True)
+    paths = []
+    for d, dept in enumerate(depts):
+        for p, provider in enumerate(providers):
+            file_seed = seed + 97 * d + p
+            pool = sku_pool(max(rows // 2, 1), file_seed)
+            for m, date in enumerate(dates):
+                df = make_frame(provider, rows, m, pool, file_seed)
+                path = os.path.join(out_dir, f"{dept}_{provider}_{date}.{fmt}")
+                paths.append(write_provider_file(df, provider, path, fmt, encoding))
+    return paths
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="生成合成的服务商库存导出文件")
+    ap.add_argument('out_dir')
+    ap.add_argument('--rows', type=int, default=10000, help="每个文件的行数")
+    ap.add_argument('--months', type=int, default=3)
+    ap.add_argument('--start', default='2024-01')
+    ap.add_argument('--depts', nargs='+', default=DEFAULT_DEPTS)
+    ap.add_argument('--providers', nargs='+', default=list(COLUMN_MAPS), choices=list(COLUMN_MAPS))
+    ap.add_argument('--format', dest='fmt', choices=['xlsx', 'csv'], default='xlsx')
+    ap.add_argument('--encoding', default='utf-8-sig', help="CSV 编码，如 gb18030")
+    ap.add_argument('--seed', type=int, default=0)
+    args = ap.parse_args(argv)
+    paths = generate(args.out_dir, args.rows, args.months, args.depts, args.providers,
+                     args.fmt, args.encoding, args.start, args.seed)
+    print(f"已生成 {len(paths)} 个文件 -> {args.out_dir}")
+
+if __name__ == '__main__':
+    main()